@@ -126,6 +126,8 @@ echo -e "\033[33mCleansing previous logs...\033[0m"
 rm -rf *.log *.json
 
 start=`date +%s`
+# stages of this run keep their logs in the same run
+export RUN_ID=$(date +%Y%m%d-%H%M%S)-$$
 
 echo -e "\033[33mPreparing workspace\033[0m"
 exe=bin/build.sh
@@ -1,10 +1,12 @@
 from agent.functions import (
     confirm_location,
     confirm_patch,
+    confirm_patches,
     definition,
     function_body,
     get_file_content,
     print_value,
+    print_values,
     run_program,
     run_to_line,
     set_expected_function,
@@ -15,7 +17,13 @@ from agent.functions import (
 )
 from autogen import ConversableAgent, register_function
 from shared.consts import CO_OUTPUT, PATCH_OUTPUT
-from shared.prompt import CO_SYSTEM, FL_SYSTEM, FL_SYSTEM_NO_DBG, PG_SYSTEM
+from shared.prompt import (
+    CO_SYSTEM,
+    FL_SYSTEM,
+    FL_SYSTEM_NO_DBG,
+    PG_PARALLEL,
+    PG_SYSTEM,
+)
 
 
 def agent_init_fl(llm_config, profile):
@@ -50,6 +58,12 @@ def agent_init_fl(llm_config, profile):
         executor=user_proxy,
         description="Print the value of an variable or array element in the current context",
     )
+    register_function(
+        print_values,
+        caller=assistant,
+        executor=user_proxy,
+        description="Print the values of several expressions at once in the current or the given frame, optionally with all arguments and locals",
+    )
     # register_function(
     #     switch_frame,
     #     caller=assistant,
@@ -101,6 +115,8 @@ def agent_init_fl(llm_config, profile):
 
 def agent_init_pg(llm_config, profile):
     system_message = PG_SYSTEM
+    if profile["validate-workers"] > 1:
+        system_message += PG_PARALLEL.format(profile["validate-workers"])
 
     # Initialize LLM agent and user proxy.
     assistant = ConversableAgent(
@@ -151,6 +167,13 @@ def agent_init_pg(llm_config, profile):
         executor=user_proxy,
         description="Confirm the patch for the fix location",
     )
+    if profile["validate-workers"] > 1:
+        register_function(
+            confirm_patches,
+            caller=assistant,
+            executor=user_proxy,
+            description="Confirm several alternative patches for the fix location at once",
+        )
 
     return assistant, user_proxy, system_message
 
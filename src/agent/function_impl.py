@@ -1,6 +1,6 @@
 import os
-import re
 
+from tools.file_integration import file_find
 from tools.lsp_integration import lsp_to_abs_path
 
 
@@ -13,143 +13,90 @@ def to_abs_path(logger, filename):
     path, cwd = lsp_to_abs_path(filename)
     if os.path.exists(path):
         return path
-    basename = os.path.basename(filename)
     # search for the file under cwd
-    for root, _, files in os.walk(cwd):
-        if basename in files:
-            return os.path.join(root, basename)
+    path = file_find(cwd, filename)
+    if path is not None:
+        return path
     # failed to find the file
     logger.error(f"File {filename} not found under {cwd}")
     return filename
 
 
-def parse_stackframe(frame):
-    pattern_1 = re.compile(
-        r"#\s*(\d+)\s+0x[0-9a-fA-F]+\s+in\s+(\w+)\s*\(([^)]*)\)\s+at\s+(\S+):(\d+)"
-    )
-    pattern_2 = re.compile(r"#(\d+)\s+(\w+)\s*\((.*?)\)\s+at\s+([\w\.\-]+):(\d+)")
-
-    matches = pattern_1.search(frame)
-    if matches is None:
-        matches = pattern_2.search(frame)
-    if matches is None:
-        return None, None, None, None, None
-    frame_number = matches.group(1)
-    function = matches.group(2)
-    args = matches.group(3)
-    filename = matches.group(4)
-    line = matches.group(5)
-
-    return int(frame_number), function, args, filename, int(line)
-
-
-def _parse_address_sanitizer_stackframe(frame):
-    pattern_1 = re.compile(
-        r"#(\d+)\s+(0x[0-9a-fA-F]+)\s+in\s+(\w+)\s+([\w/.\-]+):(\d+):(\d+)"
-    )
-    pattern_2 = re.compile(
-        r"#(\d+)\s+(0x[0-9a-fA-F]+)\s+in\s+(\w+)\s+([\w/.\-]+):(\d+)"
-    )
-    matches = pattern_1.search(frame)
-    if matches is None:
-        matches = pattern_2.search(frame)
-    if matches is None:
-        return None, None, None, None
-    frame_number = matches.group(1)
-    function = matches.group(3)
-    filename = matches.group(4)
-    line = matches.group(5)
-    return int(frame_number), function, filename, int(line)
-
-
-def _parse_undefined_sanitizer_stackframe(frame):
-    pattern = re.compile(r"^([^:]+):(\d+):(\d+):\sruntime error:\s(.+)$")
-    matches = pattern.search(frame)
-    if matches is None:
-        return None, None, None
-    filename = matches.group(1)
-    line = matches.group(2)
-    message = matches.group(4)
-
-    return filename, int(line), message
-
-
-def _extract_address_sanitizer_error(logger, response, expected_func):
-    # find the first error
-    pos1 = response.find("==ERROR: AddressSanitizer:")
-    if pos1 == -1:
-        pos1 = response.find("==WARNING: MemorySanitizer:")
-    if pos1 == -1:
-        message = "AddressSanitizer error message not found."
-        logger.error(message)
-        return None, None, message
-
-    # find the first frame
-    pos2 = response.find("#0", pos1)
-    if pos2 == -1:
-        message = "Sanitizer frame not found."
-        logger.error(message)
-        return None, None, message
-
-    message = response[pos1:pos2].replace("\n", "").strip()
-
-    message += f"\n\nThe stack trace is as follows with format #<frame number> in <function> at <file>:<line>"
-    backtrace = response[pos2:].split("\n")
-    expected_frame = None
-    expected_filename = None
-    expected_line = None
-    found = False
-    error_trace = ""
-    for trace in backtrace:
-        if trace == "":
-            if found:
-                break
-            # reset error_trace to look for the frame in the next trace
-            error_trace = ""
+def to_hunks(patch, to_path):
+    """
+    Convert a patch to hunks of editor_apply(), the patch is a single hunk or
+    {"hunks": [...]} of several hunks, each of which is an addition after
+    line or a modification from start to end. Filenames of the hunks are
+    mapped by to_path, e.g. to absolute paths in the sandbox.
+    Return (hunks, None), or (None, message) if the patch is not valid.
+    """
+    hunks = []
+    for hunk in patch.get("hunks", [patch]):
+        if not ("filename" in hunk and "patch" in hunk):
+            return None, "Invalid patch format"
+        filename = to_path(hunk["filename"])
+        if not os.path.exists(filename):
+            return None, f"File {filename} not found"
+        try:
+            if "line" in hunk:
+                # addition
+                line = int(hunk["line"])
+                hunks.append((filename, line + 1, line, hunk["patch"]))
+            elif "start" in hunk and "end" in hunk:
+                # modification
+                start, end = int(hunk["start"]), int(hunk["end"])
+                hunks.append((filename, start, end, hunk["patch"]))
+            else:
+                return None, "Invalid patch format"
+        except (TypeError, ValueError):
+            return None, "Invalid patch format, line numbers must be integers"
+    if len(hunks) == 0:
+        return None, "Invalid patch format"
+    return hunks, None
+
+
+def _format_stack(frames):
+    trace = ""
+    for frame in frames:
+        if frame["file"] is None or frame["line"] is None:
+            # no debug information, e.g. libc
             continue
-        if trace.startswith("SUMMARY:"):
-            # error ends when summary starts
+        if frame["level"] > 20:
+            trace += "\nMore than 20 frames, stopping here."
             break
-        frame_number, function, filename, line = _parse_address_sanitizer_stackframe(
-            trace
-        )
-        if frame_number is None:
-            continue
-        error_trace += f"\n#{frame_number} in {function} at {filename}:{line}"
-        if expected_func is not None and expected_func in function:
-            expected_frame = frame_number
-            expected_filename = filename
-            expected_line = line
-            found = True
-        elif expected_frame is None:
-            expected_frame = frame_number
-            expected_filename = filename
-            expected_line = line
-        if frame_number > 20:
-            error_trace += "\nMore than 20 frames, stopping here."
-    message += error_trace
+        trace += f"\n#{frame['level']} in {frame['func']} at {frame['file']}:{frame['line']}"
+    return trace
 
-    return expected_filename, expected_line, message
-
-
-def _extract_undefined_sanitizer_error(logger, response, expected_func):
-    for line in response.split("\n"):
-        expected_filename, expected_line, message = (
-            _parse_undefined_sanitizer_stackframe(line)
-        )
-        if expected_filename is not None:
-            return expected_filename, expected_line, message
-    message = "UndefinedSanitizer error message not found."
-    logger.error(message)
-    return None, None, message
 
+def extract_sanitizer_error(logger, reports, expected_func):
+    """
+    Get the location and message of the first sanitizer report, as
+    (filename, line, message). The location is in expected_func if it is
+    in the stack, otherwise the first frame with source location.
+    """
+    if len(reports) == 0:
+        message = "Sanitizer error message not found."
+        logger.error(message)
+        return None, None, message
 
-def extract_sanitizer_error(logger, response, expected_func):
-    expected_filename, expected_line, message = _extract_address_sanitizer_error(
-        logger, response, expected_func
-    )
-    if expected_filename is None:
-        expected_filename, expected_line, message = _extract_undefined_sanitizer_error(
-            logger, response, expected_func
-        )
-    return expected_filename, expected_line, message
+    report = reports[0]
+    message = " ".join([report.header] + report.description)
+    if report.access is not None and report.access["line"] not in report.description:
+        message += "\n" + report.access["line"]
+    filename, line = report.location(expected_func)
+    if len(report.frames) > 0:
+        message += f"\n\nThe stack trace is as follows with format #<frame number> in <function> at <file>:<line>"
+        message += _format_stack(report.frames)
+    if len(report.free) > 0:
+        message += "\n\nThe memory was freed at:"
+        message += _format_stack(report.free)
+    if len(report.allocation) > 0:
+        message += "\n\nThe memory was allocated at:"
+        message += _format_stack(report.allocation)
+    for title, frames in report.related:
+        # e.g. the previous access and the thread creation of TSan
+        message += f"\n\n{title}"
+        message += _format_stack(frames)
+    if filename is None:
+        logger.error("Sanitizer frame not found.")
+    return filename, line, message
@@ -11,26 +11,29 @@
 
 import json
 import logging
-import os
 import subprocess
-from typing import List
+from collections import Counter
+from typing import List, Optional
 
-from agent.function_impl import extract_sanitizer_error, parse_stackframe, to_abs_path
+from agent.function_impl import extract_sanitizer_error, to_abs_path, to_hunks
 from shared.consts import LOCALIZATION_OUTPUT, PATCH_OUTPUT
 from shared.prompt import FL_AFTER_RUN_TO_LINE
+from tools.ccache_integration import ccache_env
 from tools.file_integration import file_get_decorated_content
+from tools.gdb_integration import run_passed
 from tools.lsp_integration import uri_to_path
 from tools.tools import (
+    editor_apply,
     editor_backup_file,
-    editor_insert_after,
-    editor_replace,
     editor_restore_file,
     gdb_backtrace,
+    gdb_evaluate,
     gdb_frame,
     gdb_print,
     gdb_run,
     gdb_run_sanitizer,
     gdb_run_to_line,
+    lsp_get_errors,
     lsp_get_function,
     lsp_get_symbol_definition,
     lsp_get_symbol_summary,
@@ -61,6 +64,45 @@ def set_expected_function(function):
     expected_func = function
 
 
+def _format_args(args):
+    return ", ".join(f"{arg['name']}={arg.get('value', '...')}" for arg in args)
+
+
+def _format_frame(frame):
+    return f"{frame['func']} ({_format_args(frame['args'])}) at {frame['file']}:{frame['line']}"
+
+
+def _describe_stop(stopped):
+    """
+    Describe where and why the program stopped, like GDB does.
+    """
+    reason = stopped["reason"]
+    if reason == "signal-received":
+        message = f"Program received signal {stopped.get('signal-name', '?')}, {stopped.get('signal-meaning', '')}.\n"
+    elif reason == "breakpoint-hit":
+        message = f"Breakpoint {stopped.get('bkptno', '?')}, "
+    elif reason == "exited-normally":
+        return "Program exited normally."
+    elif reason == "exited":
+        return f"Program exited with code {stopped.get('exit-code', '?')}."
+    elif reason == "timeout":
+        message = "Program did not finish in time and was interrupted.\n"
+    elif reason is None:
+        return "Program did not stop in time."
+    else:
+        message = f"Program stopped ({reason}).\n"
+
+    frame = stopped.get("frame", None)
+    if frame is None:
+        return message
+    if frame["line"] is None:
+        return message + f"{frame['addr']} in {frame['func']} ()"
+    message += _format_frame(frame) + "\n"
+    filename = to_abs_path(logger, frame["fullname"] or frame["file"])
+    message += file_get_decorated_content(filename, frame["line"], frame["line"])
+    return message
+
+
 def _run_gdb():
     """
     Run the program to be debugged.
@@ -69,35 +111,38 @@ def _run_gdb():
     """
     logger.info("CALL> run_program (GDB)")
 
-    response = gdb_run()
+    stopped = gdb_run()
 
-    if "exited normally" in response:
+    if stopped["reason"] == "exited-normally":
         message = "[PASSED] Program exited normally."
         logger.info(message)
         return message
 
-    if "exited with code" in response:
+    if stopped["reason"] == "exited":
         message = "[REVIEW] Program exited with code."
         logger.warning(message)
         return message
 
-    message = "Program crashed with error.\n"
-    message += "\n".join(response.split("\n")[-4:-1])
+    if stopped["reason"] == "timeout":
+        message = "Program timed out.\n"
+    else:
+        message = "Program crashed with error.\n"
+    message += _describe_stop(stopped)
     message += f"\n\nThe stack trace is as follows with format #<frame number> in <function> (<args>) at <file>:<line>"
 
-    backtrace = gdb_backtrace()
     expected_frame = None
-    for trace in backtrace.split("\n"):
-        frame_number, function, args, filename, line = parse_stackframe(trace)
-        if frame_number is None:
+    for frame in gdb_backtrace():
+        if frame["line"] is None:
+            # no debug information
             continue
-        message += f"\n#{frame_number} in {function} ({args}) at {filename}:{line}"
-        if expected_func is not None and expected_func in function:
-            expected_frame = frame_number
-        elif expected_frame is None:
-            expected_frame = frame_number
-        if frame_number > 20:
+        if frame["level"] > 20:
             message += "\nMore than 20 frames, stopping here."
+            break
+        message += f"\n#{frame['level']} in {_format_frame(frame)}"
+        if expected_func is not None and expected_func in frame["func"]:
+            expected_frame = frame["level"]
+        elif expected_frame is None:
+            expected_frame = frame["level"]
     message += "\n"
 
     if expected_frame is not None:
@@ -131,7 +176,12 @@ def _run_sanitizer():
 
     response = gdb_run_sanitizer()
 
-    if "exited normally" in response:
+    if response["reason"] == "timeout":
+        message = "[TIMEOUT] Program did not finish within the time limit."
+        logger.info(message)
+        return message
+
+    if run_passed(response["reason"], "sanitizer"):
         message = "[PASSED] Program exited normally."
         logger.info(message)
         return message
@@ -139,7 +189,7 @@ def _run_sanitizer():
     message = "Program crashed due to sanitizer error:\n"
 
     expected_filename, expected_line, sanitizer_message = extract_sanitizer_error(
-        logger, response, expected_func
+        logger, response["reports"], expected_func
     )
 
     message += sanitizer_message
@@ -186,6 +236,21 @@ def run_program() -> str:
     return run_program_impl()
 
 
+# Not tool
+def reset_state():
+    """
+    Reset the state of the functions left by a job, e.g. the crash site, so
+    that the next job in the same process does not pick it up.
+    """
+    global expected_func, san_crashed_file, san_crashed_line
+    global validate_callback, validate_pool
+    expected_func = None
+    san_crashed_file = None
+    san_crashed_line = None
+    validate_callback = None
+    validate_pool = None
+
+
 def print_value(value: str) -> str:
     """
     Print the value of an variable in the current context.
@@ -194,14 +259,61 @@ def print_value(value: str) -> str:
 
     value = str(value)
 
-    response = gdb_print(value)
-    # TODO: handle error response
+    result, error = gdb_print(value)
+    if error is None:
+        response = f"{value} = {result}"
+    else:
+        response = f"Failed to print {value}: {error}"
 
     logger.info(response)
 
     return response
 
 
+def print_values(
+    expressions: List[str], frame: Optional[int] = None, include_locals: bool = False
+) -> str:
+    """
+    Print the values of several expressions at once, in the current or the
+    given frame, and optionally all arguments and locals there.
+    """
+    logger.info(f"CALL> print_values({expressions}, {frame}, {include_locals})")
+
+    expressions = [str(expression) for expression in expressions]
+    if frame is not None:
+        frame = int(frame)
+
+    response = gdb_evaluate(expressions, frame, bool(include_locals))
+    if response["error"] is not None:
+        message = f"Failed to switch to frame {frame}: {response['error']}"
+        logger.error(message)
+        return message
+
+    selected = response["frame"]
+    if selected is not None and selected["line"] is not None:
+        message = f"Values in frame {selected['level']}, function {selected['func']} at {selected['file']}:{selected['line']}:\n"
+    else:
+        message = "Values in the current frame:\n"
+    for expression, value, error in response["values"]:
+        if error is None:
+            message += f"{expression} = {value}\n"
+        else:
+            message += f"{expression}: <error: {error}>\n"
+
+    if response["variables"] is not None:
+        message += "Arguments and locals:\n"
+        if len(response["variables"]) == 0:
+            message += "(none)\n"
+        for variable in response["variables"]:
+            kind = "arg" if variable["arg"] else "local"
+            value = variable.get("value", "<compound, print its members>")
+            message += f"({kind}) {variable.get('type', '?')} {variable['name']} = {value}\n"
+
+    logger.info(message)
+
+    return message
+
+
 def switch_frame(frame: int) -> str:
     """
     Switch to a different stack frame.
@@ -209,16 +321,14 @@ def switch_frame(frame: int) -> str:
     logger.info(f"CALL> switch_frame({frame})")
     frame = int(frame)
 
-    response = gdb_frame(frame)
-    frame = response.split("\n")[0]
-
-    frame_number, function, args, filename, line = parse_stackframe(frame)
-    if frame_number is None:
+    selected = gdb_frame(frame)
+    if selected is None or selected["line"] is None:
         logger.error(f"Invalid frame: {frame}")
         return "Invalid frame number, please switch to another valid frame."
-    filename = to_abs_path(logger, filename)
+    filename = to_abs_path(logger, selected["fullname"] or selected["file"])
+    line = selected["line"]
 
-    message = f"Switched to frame {frame}, function {function} at {filename}:{line}.\n"
+    message = f"Switched to frame {frame}, function {selected['func']} at {filename}:{line}.\n"
     message += file_get_decorated_content(filename, line, line)
 
     logger.info(message)
@@ -242,23 +352,15 @@ def run_to_line(filename: str, line: int) -> str:
         to_line = san_crashed_line
     else:
         to_line = None
-    response = gdb_run_to_line(filename, line, to_line)
+    stopped = gdb_run_to_line(filename, line, to_line)
 
-    if "Breakpoint" in response:
+    if stopped["reason"] == "breakpoint-hit":
         message = f"Program stopped at {filename}:{line}.\n"
-        message += "\n".join(response.split("\n")[-3:-1])
     else:
         message = f"Program crashed before {filename}:{line}.\n"
-        message += "\n".join(response.split("\n")[-3:-1])
+    message += _describe_stop(stopped)
     message += "\n\n"
     message += FL_AFTER_RUN_TO_LINE
-    # message += "\n"
-    # message += "Currently available stack frames:\n"
-    # backtrace = gdb_backtrace()
-    # for trace in backtrace.split("\n"):
-    #     frame_number, function, args, filename, line = _parse_stackframe(trace)
-    #     if frame_number is not None:
-    #         message += f"\n#{frame_number} in {function} ({args}) at {filename}:{line}"
 
     logger.info(message)
 
@@ -362,16 +464,19 @@ patch_output = PATCH_OUTPUT
 
 # Not tool
 def set_patch_output(output: str):
-    global patch_output
+    """
+    Set the output of confirmed patches, which also starts counting
+    failed patches again.
+    """
+    global patch_output, patch_count
     patch_output = output
+    patch_count = 0
 
 
 def confirm_patch(patch: dict) -> str:
     """
     Confirm the locations of the bug.
     """
-    global patch_count
-
     logger.info(f"CALL> confirm_patch({patch})")
 
     for key, value in patch.items():
@@ -387,6 +492,22 @@ def confirm_patch(patch: dict) -> str:
         logger.info(message)
         return message
 
+    message = _count_failed_patch()
+    if message is not None:
+        return message
+
+    message = f"The patch is not valid, please generate another patch. The reason is that: {response}"
+    logger.info(message)
+    return message
+
+
+def _count_failed_patch():
+    """
+    Count a failed confirmation, and give up after too many failures
+    by faking a valid response.
+    """
+    global patch_count
+
     patch_count += 1
     if patch_count >= 5:
         # fake a valid response
@@ -396,8 +517,52 @@ def confirm_patch(patch: dict) -> str:
         message = "Valid, respond with TERMINATE"
         logger.info(message)
         return message
+    return None
 
-    message = f"The patch is not valid, please generate another patch. The reason is that: {response}"
+
+validate_pool = None
+
+
+# Not tool
+def set_validate_pool(pool):
+    global validate_pool
+    validate_pool = pool
+
+
+def confirm_patches(patches: List[dict]) -> str:
+    """
+    Confirm several alternative patches, which are validated at the same
+    time. The first valid one is accepted.
+    """
+    logger.info(f"CALL> confirm_patches({patches})")
+
+    for patch in patches:
+        if "filename" in patch:
+            patch["filename"] = to_abs_path(logger, patch["filename"])
+
+    results = validate_pool.validate(patches)
+    for patch, (valid, _) in zip(patches, results):
+        if not valid:
+            continue
+        with open(patch_output, "w") as f:
+            f.write(json.dumps(patch, indent=4))
+        # keep the accepted patch in the sandbox
+        status, reason = apply_patch()
+        if not status:
+            logger.error(f"Failed to apply patch: {reason}")
+            break
+        message = "Valid, respond with TERMINATE"
+        logger.info(message)
+        return message
+
+    message = _count_failed_patch()
+    if message is not None:
+        return message
+
+    reasons = "\n".join(
+        f"Patch {i + 1}: {reason}" for i, (_, reason) in enumerate(results)
+    )
+    message = f"None of the patches is valid, please generate other patches. The reasons are that:\n{reasons}"
     logger.info(message)
     return message
 
@@ -428,6 +593,19 @@ def get_file_content(filename: str, start_line: int, end_line: int) -> str:
 # These functions are not called by LLM.
 
 
+def _to_hunks(patch):
+    return to_hunks(patch, lambda filename: to_abs_path(logger, filename))
+
+
+def _get_patch_files():
+    with open(patch_output, "r") as f:
+        patch = json.load(f)
+    hunks, _ = _to_hunks(patch)
+    if hunks is None:
+        return []
+    return sorted(set(filename for filename, _, _, _ in hunks))
+
+
 # Not tool
 def apply_patch():
     with open(patch_output, "r") as f:
@@ -435,43 +613,31 @@ def apply_patch():
 
     logger.info(f"CALL> apply_patch({patch})")
 
-    if not ("filename" in patch and "patch" in patch):
-        return False, "Invalid patch format"
+    hunks, message = _to_hunks(patch)
+    if hunks is None:
+        return False, message
 
-    filename = to_abs_path(logger, patch["filename"])
-    content = patch["patch"]
-
-    if not os.path.exists(filename):
-        return False, f"File {filename} not found"
-    editor_backup_file(filename)
-
-    if "line" in patch:
-        # addition
-        line = patch["line"]
-        editor_insert_after(filename, line, content)
-    elif "start" in patch and "end" in patch:
-        # modification
-        start = patch["start"]
-        end = patch["end"]
-        editor_replace(filename, start, end, content)
-    else:
-        return False, "Invalid patch format"
+    for filename, _, _, _ in hunks:
+        editor_backup_file(filename)
+    try:
+        # all hunks are applied, or none of them
+        editor_apply(hunks)
+    except ValueError as e:
+        return False, str(e)
 
     return True, None
 
 
 # Not tool
 def undo_patch():
-    with open(patch_output, "r") as f:
-        patch = json.load(f)
-
     logger.info(f"CALL> undo_patch()")
 
-    if not ("filename" in patch):
+    filenames = _get_patch_files()
+    if len(filenames) == 0:
         return False, "Invalid patch format"
 
-    filename = to_abs_path(logger, patch["filename"])
-    editor_restore_file(filename)
+    for filename in filenames:
+        editor_restore_file(filename)
 
     return True, None
 
@@ -495,6 +661,7 @@ def test_build(profile):
     build = subprocess.run(
         profile["build"],
         cwd=profile["sandbox"],
+        env=ccache_env(profile["ccache"], profile["sandbox"]),
         stdout=subprocess.DEVNULL,
         stderr=subprocess.PIPE,
     )
@@ -515,17 +682,57 @@ def test_run(profile):
     return False, result
 
 
+def test_syntax(filename, baseline):
+    """
+    Check the patched file with diagnostics of the language server, which is
+    much faster than building. Errors already in baseline, the errors before
+    the patch, are not counted, as they may come from the setup of clangd.
+    Return (True, "") if no new error or diagnostics are not available.
+    """
+    errors = lsp_get_errors(filename)
+    if errors is None:
+        return True, ""
+    known = Counter(message for _, message in baseline)
+    new_errors = []
+    for line, message in errors:
+        if known[message] > 0:
+            known[message] -= 1
+        else:
+            new_errors.append(f"{filename}:{line}: error: {message}")
+    if len(new_errors) == 0:
+        return True, ""
+    logger.error("Patch introduces errors")
+    return False, "\n".join(new_errors)
+
+
 def validate(app_logger, profile):
     """
     Validate the patch.
     """
     app_logger.info(f"Validating patch")
 
+    baselines = {}
+    for filename in _get_patch_files():
+        baselines[filename] = lsp_get_errors(filename)
+
     status, message = apply_patch()
     if not status:
         app_logger.error(f"Failed to apply patch: {message}")
         return message
 
+    for filename, baseline in baselines.items():
+        if baseline is None:
+            continue
+        status, errors = test_syntax(filename, baseline)
+        if not status:
+            result = f"Patch is syntactically invalid, please fix the errors below:\n{errors}"
+            app_logger.error(result)
+            status, message = undo_patch()
+            if not status:
+                app_logger.error(f"Failed to undo patch: {message}")
+                return message
+            return result
+
     status, result = test_build(profile)
     if status:
         status, result = test_run(profile)
@@ -0,0 +1,162 @@
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from agent.function_impl import to_abs_path, to_hunks
+from shared.utils import (
+    copy_dir_content,
+    ensure_empty_dir,
+    get_project_cache,
+    sync_dir_content,
+)
+from tools.ccache_integration import ccache_env
+from tools.gdb_integration import classify_run, run_bounded, run_passed
+from tools.tools import editor_apply, editor_backup_file, editor_restore_file
+
+
+def _relocate(value: str, src: str, dest: str) -> str:
+    if value == src or value.startswith(src + os.sep):
+        return dest + value[len(src) :]
+    return value
+
+
+class ValidatorPool:
+    """
+    Validate several patch candidates at the same time. Each candidate is
+    applied to its own clone of the built sandbox, where it is built and run
+    against the POC without GDB.
+    """
+
+    def __init__(self, profile, workers: int, logger) -> None:
+        self._profile = profile
+        self._workers = workers
+        self._logger = logger
+        self._clones = None  # [(sandbox, work)]
+
+    def _prepare_clone(self, index):
+        profile = self._profile
+        sandbox = f"{profile['sandbox']}.clone-{index}"
+        work = f"{profile['work']}.clone-{index}"
+        manifest = os.path.join(
+            get_project_cache(profile, "sync"), f"clone-{index}.json"
+        )
+        sync_dir_content(profile["sandbox"], sandbox, manifest)
+        ensure_empty_dir(work)
+        copy_dir_content(profile["work"], work)
+
+        # configure again, as generated build files may refer to the sandbox
+        if profile["pre-build"] is not None:
+            subprocess.run(
+                profile["pre-build"],
+                cwd=sandbox,
+                env=ccache_env(profile["ccache"], sandbox),
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        return sandbox, work
+
+    def _prepare(self):
+        if self._clones is not None:
+            return
+        self._logger.info(f"Preparing {self._workers} sandbox clones")
+        with ThreadPoolExecutor(self._workers) as executor:
+            self._clones = list(executor.map(self._prepare_clone, range(self._workers)))
+
+    def _to_clone_path(self, clone, filename):
+        filename = to_abs_path(self._logger, filename)
+        return _relocate(filename, self._profile["sandbox"], clone[0])
+
+    def _apply(self, clone, patch):
+        """
+        Apply the patch in the clone, return (patched files, None), or
+        (None, message) if the patch is not valid.
+        """
+        hunks, message = to_hunks(
+            patch, lambda filename: self._to_clone_path(clone, filename)
+        )
+        if hunks is None:
+            return None, message
+        filenames = sorted(set(filename for filename, _, _, _ in hunks))
+
+        for filename in filenames:
+            editor_backup_file(filename)
+        try:
+            editor_apply(hunks)
+        except ValueError as e:
+            return None, str(e)
+        return filenames, None
+
+    def _build_and_run(self, clone):
+        profile = self._profile
+        sandbox, work = clone
+
+        build = subprocess.run(
+            profile["build"],
+            cwd=sandbox,
+            env=ccache_env(profile["ccache"], sandbox),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        if build.returncode != 0:
+            return (
+                False,
+                "Patch is syntactically invalid, please check brace matching and variable names",
+            )
+
+        cmd = [_relocate(profile["run"], profile["sandbox"], sandbox)]
+        cmd += [_relocate(arg, profile["work"], work) for arg in profile["args"]]
+        env = {
+            key: _relocate(value, profile["sandbox"], sandbox)
+            for key, value in profile["env"].items()
+        }
+        timeout = profile["timeout"]
+        reason, code, error, reports = run_bounded(
+            cmd, work, env, timeout["sanitizer"], timeout["cpu"], sandbox=sandbox
+        )
+        reason = classify_run(reason, code, reports)
+        if reason == "timeout":
+            return False, f"The program did not finish in {timeout['sanitizer']} seconds"
+        if run_passed(reason, profile["mode"]):
+            return True, ""
+        error = "\n".join(error.split("\n")[-10:])
+        return False, f"The program still crashes: {error}"
+
+    def validate(self, patches: List[dict]):
+        """
+        Validate all patches, return a list of (valid, reason) in the same
+        order as the patches. Patches are not kept in the clones.
+        """
+        self._prepare()
+        results = [None] * len(patches)
+        for begin in range(0, len(patches), self._workers):
+            batch = list(enumerate(patches[begin : begin + self._workers], begin))
+
+            # apply patches one by one, as editor functions are not thread-safe
+            applied = []
+            try:
+                for (index, patch), clone in zip(batch, self._clones):
+                    filenames, message = self._apply(clone, patch)
+                    if filenames is None:
+                        results[index] = (False, message)
+                    else:
+                        applied.append((index, clone, filenames))
+
+                with ThreadPoolExecutor(self._workers) as executor:
+                    outcomes = executor.map(
+                        lambda item: self._build_and_run(item[1]), applied
+                    )
+                    for (index, _, _), outcome in zip(applied, outcomes):
+                        results[index] = outcome
+            finally:
+                # clones must not keep patches for the next rounds
+                for _, _, filenames in applied:
+                    for filename in filenames:
+                        editor_restore_file(filename)
+
+        for index, (valid, reason) in enumerate(results):
+            if valid:
+                self._logger.info(f"Candidate {index} is valid")
+            else:
+                self._logger.error(f"Candidate {index} is invalid: {reason}")
+        return results
@@ -0,0 +1,58 @@
+import json
+import os
+import sys
+
+from shared.arguments import parse_args_artifacts
+from shared.store import ArtifactStore
+
+
+def _find_run(store, profile, run):
+    for manifest in store.runs(profile):
+        if manifest["run"] == run:
+            return manifest
+    return None
+
+
+def list_runs(store, profile):
+    manifests = store.runs(profile)
+    total = 0
+    digests = set()
+    for manifest in manifests:
+        artifacts = manifest["artifacts"].values()
+        size = sum(artifact["size"] for artifact in artifacts)
+        result = manifest.get("result", "-")
+        print(f"{manifest['run']:<28} {manifest['profile']:<40} {result:<8} {size:>10}")
+        total += size
+        digests.update(artifact["hash"] for artifact in artifacts)
+
+    stored = 0
+    for digest in digests:
+        stored += os.path.getsize(store.object_path(digest))
+    print(f"Runs: {len(manifests)}, artifacts: {total} bytes, stored: {stored} bytes")
+
+
+if __name__ == "__main__":
+    args = parse_args_artifacts()
+    store = ArtifactStore(args.log)
+
+    if args.run is None:
+        list_runs(store, args.profile)
+        exit(0)
+
+    manifest = _find_run(store, args.profile, args.run)
+    if manifest is None:
+        print(f"Run {args.run} not found", file=sys.stderr)
+        exit(1)
+    if args.artifact is None:
+        print(json.dumps(manifest, indent=4))
+        exit(0)
+
+    if args.artifact not in manifest["artifacts"]:
+        print(f"Artifact {args.artifact} not found in run {args.run}", file=sys.stderr)
+        exit(1)
+    digest = manifest["artifacts"][args.artifact]["hash"]
+    if args.output is not None:
+        store.export(digest, args.output)
+    else:
+        with store.open(digest) as f:
+            sys.stdout.buffer.write(f.read())
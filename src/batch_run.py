@@ -0,0 +1,187 @@
+import glob
+import json
+import os
+import resource
+import signal
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from shared.arguments import find_profile, get_run_id, parse_args_batch
+
+SRC = os.path.dirname(os.path.abspath(__file__))
+RESULT_FILE = "validate.lock"
+OUTPUT_FILE = "batch.out"
+
+RED = "\033[31m"
+GREEN = "\033[32m"
+YELLOW = "\033[33m"
+BLUE = "\033[34m"
+MAGENTA = "\033[35m"
+RESET = "\033[0m"
+
+
+def _prepare_run(name, args):
+    """
+    Prepare the run directory of a profile, where all artifacts and logs of
+    the run are written. The sandbox and work directory are placed under it,
+    so that runs do not interfere with each other.
+    Return the run directory and the path to its profile.
+    """
+    filename = find_profile(name)
+    with open(filename, "r") as f:
+        profile = json.load(f)
+
+    run_name = os.path.splitext(os.path.basename(filename))[0]
+    run_dir = os.path.abspath(os.path.join(args.output, run_name))
+    os.makedirs(run_dir, exist_ok=True)
+    # same as `rm -rf *.log *.json` in run_agent.sh, the sandbox is kept
+    for pattern in ["*.log", "*.json", RESULT_FILE, OUTPUT_FILE]:
+        for path in glob.glob(os.path.join(run_dir, pattern)):
+            os.remove(path)
+
+    profile["project"] = os.path.abspath(profile["project"])
+    profile["sandbox"] = os.path.join(run_dir, ".sandbox")
+    profile["work"] = os.path.join(run_dir, ".work")
+    # caches and the log store are shared between runs
+    profile["cache"] = os.path.abspath(profile.get("cache", None) or ".cache")
+    profile["log"] = os.path.abspath(profile.get("log", None) or "log")
+    if not profile.get("profile", None):
+        profile["profile"] = run_name
+
+    profile_file = os.path.join(run_dir, "profile.json")
+    with open(profile_file, "w") as f:
+        f.write(json.dumps(profile, indent=4))
+    return run_dir, profile_file
+
+
+def _run_stage(script, options, run_dir, output, args, env):
+    """
+    Run a stage in the run directory with the resource limits.
+    Return the exit code, or None if the stage timed out.
+    """
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(SRC, script)] + options,
+        cwd=run_dir,
+        env=env,
+        stdin=subprocess.PIPE,
+        stdout=output,
+        stderr=subprocess.STDOUT,
+        # so that GDB and clangd can be killed along with the stage
+        start_new_session=True,
+    )
+    if args.memory is not None:
+        limit = args.memory << 20
+        resource.prlimit(process.pid, resource.RLIMIT_AS, (limit, limit))
+
+    try:
+        # same as `echo exit |` in the scripts
+        process.communicate(b"exit\n", timeout=args.timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+        output.write(f"\n{script} timed out after {args.timeout}s\n".encode())
+        return None
+    return process.returncode
+
+
+def run_profile(name, args):
+    """
+    Repair a project in its own run directory, which is the same as
+    scripts/run_agent.sh. Return the content of validate.lock, or None
+    if the run aborted.
+    """
+    run_dir, profile_file = _prepare_run(name, args)
+    options = ["--config", os.path.abspath(args.config), "--profile", profile_file]
+    if args.no_constraint:
+        options.append("--no-constraint")
+    result_file = os.path.join(run_dir, RESULT_FILE)
+    # stages of the run keep their logs in the same run
+    env = dict(os.environ, RUN_ID=get_run_id())
+
+    with open(os.path.join(run_dir, OUTPUT_FILE), "wb") as output:
+        code = _run_stage(
+            "build.py", ["--profile", profile_file], run_dir, output, args, env
+        )
+        if code != 0:
+            return None
+
+        for rerun in [False, True]:
+            stages = [
+                ("fix_localization.py", ["--keep"] + (["--rerun"] if rerun else [])),
+                ("patch_generation.py", ["--keep"]),
+                ("validate.py", ["--keep"]),
+            ]
+            for script, extra in stages:
+                code = _run_stage(script, options + extra, run_dir, output, args, env)
+                if code != 0:
+                    return None
+
+            if not os.path.exists(result_file):
+                return None
+            with open(result_file, "r") as f:
+                result = f.read().strip()
+            if result != "invalid":
+                return result
+    return result
+
+
+if __name__ == "__main__":
+    args = parse_args_batch()
+
+    with open(args.profiles, "r") as f:
+        profiles = f.read().split()
+
+    print("================ Overview ===============")
+    print(f"{MAGENTA}Batch Repair with Agent{RESET}")
+    if args.no_constraint:
+        print(f"{YELLOW}Constraint disabled{RESET}")
+    print("Profiles to run:")
+    for profile in profiles:
+        print(f"    {profile}")
+    total = len(profiles)
+    if total == 0:
+        print("No profile to run")
+        exit(0)
+    print(f"{BLUE}Total profiles: {total}{RESET}")
+    print(f"{BLUE}Parallel runs: {args.jobs}{RESET}")
+
+    print("========================== Running ==========================")
+    passed = 0
+    failed = 0
+    exception = 0
+    all_start = time.time()
+
+    def _run(profile):
+        start = time.time()
+        try:
+            result = run_profile(profile, args)
+        except Exception as e:
+            result = None
+            print(f"{profile}: {e}", file=sys.stderr)
+        return result, time.time() - start
+
+    with ThreadPoolExecutor(args.jobs) as executor:
+        futures = {executor.submit(_run, profile): profile for profile in profiles}
+        for index, future in enumerate(as_completed(futures), 1):
+            profile = futures[future]
+            result, duration = future.result()
+            line = f"[{index:2}/{total:2}] {profile:<30} ... [{duration:7.2f}s] ... "
+            if result == "valid":
+                print(f"{line}{GREEN}[✓]{RESET}")
+                passed += 1
+            elif result == "invalid":
+                print(f"{line}{RED}[✗]{RESET}")
+                failed += 1
+            else:
+                print(f"{line}{YELLOW}[?]{RESET}")
+                exception += 1
+    all_end = time.time()
+
+    print("========================= Summary ===========================")
+    print(f"{GREEN}     Passed: {passed} ({passed * 100 / total:.2f}%){RESET}")
+    print(f"{RED}     Failed: {failed}{RESET}")
+    print(f"{YELLOW}Other Error: {exception}{RESET}")
+    print(f"{BLUE}      Total: {total}{RESET}")
+    print(f"Total time: [{all_end - all_start:10.2f}s]")
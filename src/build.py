@@ -1,15 +1,38 @@
+import json
 import os
+import shutil
 import subprocess
 
 from shared.arguments import parse_args_build
-from shared.utils import copy_dir_content, ensure_empty_dir, get_logger
+from shared.utils import (
+    copy_dir_content,
+    ensure_empty_dir,
+    get_logger,
+    get_project_cache,
+    sync_dir_content,
+)
+from tools.ccache_integration import ccache_env, ccache_stats, ccache_zero_stats
+from tools.lsp_integration import LspWrapper, is_lsp_available
 
 logger = get_logger(__name__)
 
+COMPILE_COMMANDS = "compile_commands.json"
+
 
 def _prepare_sandbox(profile):
+    manifest = os.path.join(get_project_cache(profile, "sync"), "manifest.json")
+    if profile["incremental"]:
+        copied, deleted = sync_dir_content(
+            profile["project"], profile["sandbox"], manifest
+        )
+        logger.info(f"Synced sandbox: {copied} copied, {deleted} deleted")
+        return
+
     ensure_empty_dir(profile["sandbox"])
     copy_dir_content(profile["project"], profile["sandbox"])
+    # manifest is no longer valid after a full copy
+    if os.path.exists(manifest):
+        os.remove(manifest)
 
 
 def _prepare_work(profile):
@@ -18,11 +41,55 @@ def _prepare_work(profile):
         copy_dir_content(profile["init"], profile["work"])
 
 
+def _prepare_index(profile):
+    """
+    Link the clangd index of the sandbox to the persistent one of the project,
+    and restore compile_commands.json from previous builds if available.
+    """
+    cache = get_project_cache(profile, "clangd")
+
+    index = os.path.join(profile["sandbox"], ".cache", "clangd", "index")
+    if not os.path.lexists(index):
+        os.makedirs(os.path.dirname(index), exist_ok=True)
+        os.makedirs(os.path.join(cache, "index"), exist_ok=True)
+        os.symlink(os.path.join(cache, "index"), index)
+
+    compile_commands = os.path.join(profile["sandbox"], COMPILE_COMMANDS)
+    cached = os.path.join(cache, COMPILE_COMMANDS)
+    if not os.path.exists(compile_commands) and os.path.exists(cached):
+        logger.info(f"Using cached {COMPILE_COMMANDS}")
+        shutil.copyfile(cached, compile_commands)
+
+
+def _save_compile_commands(profile):
+    compile_commands = os.path.join(profile["sandbox"], COMPILE_COMMANDS)
+    if not os.path.exists(compile_commands):
+        logger.warning(f"{COMPILE_COMMANDS} not generated, LSP may not work")
+        return
+    cache = get_project_cache(profile, "clangd")
+    shutil.copyfile(compile_commands, os.path.join(cache, COMPILE_COMMANDS))
+
+
+def _get_build_command(profile):
+    """
+    Wrap the build command with bear to generate compile_commands.json if
+    it is not available yet.
+    """
+    build = profile["build"]
+    if os.path.exists(os.path.join(profile["sandbox"], COMPILE_COMMANDS)):
+        return build
+    if "bear" in build[0] or shutil.which("bear") is None:
+        return build
+    return ["bear", "--"] + build
+
+
 def _build_project(profile):
+    env = ccache_env(profile["ccache"], profile["sandbox"])
     if profile["pre-build"] is not None:
         pre_build = subprocess.run(
             profile["pre-build"],
             cwd=profile["sandbox"],
+            env=env,
             stdout=subprocess.DEVNULL,
             stderr=subprocess.PIPE,
         )
@@ -32,8 +99,9 @@ def _build_project(profile):
             return False
 
     build = subprocess.run(
-        profile["build"],
+        _get_build_command(profile),
         cwd=profile["sandbox"],
+        env=env,
         stdout=subprocess.DEVNULL,
         stderr=subprocess.PIPE,
     )
@@ -45,21 +113,65 @@ def _build_project(profile):
     return True
 
 
-if __name__ == "__main__":
-    args, profile, _ = parse_args_build()
-
+def _warm_up_lsp(profile):
+    """
+    Start clangd to build the persistent background index, so that later
+    stages start with a warm index.
+    """
+    compile_commands = os.path.join(profile["sandbox"], COMPILE_COMMANDS)
+    if not is_lsp_available() or not os.path.exists(compile_commands):
+        logger.warning("Skip LSP warm-up")
+        return
+
+    with open(compile_commands, "r") as f:
+        commands = json.load(f)
+    if len(commands) == 0:
+        logger.warning(f"No entry in {COMPILE_COMMANDS}, skip LSP warm-up")
+        return
+    filename = os.path.join(commands[0]["directory"], commands[0]["file"])
+
+    # indexing starts when the first file is opened
+    lsp = LspWrapper(cwd=profile["sandbox"], index_timeout=profile["index-timeout"])
+    lsp.document_symbol(filename)
+    lsp.exit()
+    logger.info("Indexing took {:.2f}s".format(lsp.index_time))
+
+
+def run_build(profile):
+    """
+    Prepare the sandbox and work directory, and build the project.
+    Return False if the build failed.
+    """
     logger.info("Preparing sandbox")
     _prepare_sandbox(profile)
+    _prepare_index(profile)
 
     logger.info("Preparing work directory")
     _prepare_work(profile)
 
     logger.info("Building project")
+    ccache_zero_stats(profile["ccache"])
     if not _build_project(profile):
         logger.error("Failed to build project")
-        exit(1)
+        return False
+    stats = ccache_stats(profile["ccache"])
+    if stats is not None:
+        logger.info(f"Compiler cache: {stats['hits']} hits, {stats['misses']} misses")
 
     if not os.path.exists(profile["run"]):
         logger.warning(f"Executable {profile['run']} not found")
 
+    _save_compile_commands(profile)
+    return True
+
+
+if __name__ == "__main__":
+    args, profile, _ = parse_args_build()
+
+    if not run_build(profile):
+        exit(1)
+
+    logger.info("Warming up LSP")
+    _warm_up_lsp(profile)
+
     logger.info("Build complete")
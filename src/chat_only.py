@@ -1,6 +1,4 @@
 import json
-import os
-import shutil
 
 from agent.agent import agent_init_co
 from agent.functions import (
@@ -12,40 +10,36 @@ from agent.functions import (
 from shared.arguments import parse_args_co
 from shared.consts import CO_OUTPUT, CO_SNAPSHOT
 from shared.prompt import CO_CONSTRAINT, CO_INITIAL_MESSAGE
+from shared.store import store_artifacts
 from shared.utils import get_duration, get_logger
+from tools.exec_cache import exec_cache_init
 from tools.gdb_integration import gdb_exit, gdb_init
+from tools.lsp_cache import lsp_cache_init
 from tools.lsp_integration import lsp_exit, lsp_init
+from tools.tools import editor_diff
 
 logger = get_logger(__name__, log_file="co.log")
 
 
 def keep_log(profile):
-    if not os.path.exists(f"log/{profile['profile']}"):
-        os.makedirs(f"log/{profile['profile']}")
-
-    shutil.copyfile(CO_SNAPSHOT, f"log/{profile['profile']}/{CO_SNAPSHOT}")
-    shutil.copyfile("co.log", f"log/{profile['profile']}/co.log")
-    shutil.copyfile("function.log", f"log/{profile['profile']}/co_function.log")
-    shutil.copyfile(CO_OUTPUT, f"log/{profile['profile']}/{CO_OUTPUT}")
-
+    store_artifacts(
+        profile,
+        {
+            CO_SNAPSHOT: CO_SNAPSHOT,
+            "co.log": "co.log",
+            "co_function.log": "function.log",
+            CO_OUTPUT: CO_OUTPUT,
+        },
+    )
 
-if __name__ == "__main__":
-    args, profile, llm_config = parse_args_co()
 
+def run_chat_only(profile, llm_config, keep=False):
+    """
+    Run chat only patch generation, GDB and LSP should be initialized.
+    """
     # log of essential information
     snapshot = {"profile": profile}
 
-    logger.info("Initializing GDB")
-    gdb_init(
-        profile["run"],
-        profile["args"],
-        profile["env"],
-        profile["work"],
-    )
-
-    logger.info("Initializing LSP")
-    lsp_init(cwd=profile["sandbox"])
-
     logger.info("Initializing agent")
     assistant, user_proxy, system_message = agent_init_co(llm_config, profile)
 
@@ -87,15 +81,41 @@ if __name__ == "__main__":
         with open(CO_OUTPUT, "r") as f:
             patch = f.read()
         snapshot["patch"] = json.loads(patch)
+        # changes kept in the sandbox, i.e. the validated patch
+        snapshot["diff"] = editor_diff(profile["sandbox"])
 
         snapshot["duration"] = get_duration(profile)
         with open(CO_SNAPSHOT, "w") as f:
             f.write(json.dumps(snapshot, indent=4))
 
+    if keep:
+        keep_log(profile)
+
+
+if __name__ == "__main__":
+    args, profile, llm_config = parse_args_co()
+
+    logger.info("Initializing GDB")
+    gdb_init(
+        profile["run"],
+        profile["args"],
+        profile["env"],
+        profile["work"],
+        profile["timeout"],
+        profile["core-cache"],
+        profile["checkpoint"],
+        profile["gdb-index"],
+        profile["gdb-pool"],
+    )
+
+    logger.info("Initializing LSP")
+    lsp_init(cwd=profile["sandbox"], index_timeout=profile["index-timeout"])
+    lsp_cache_init(profile["lsp-cache"])
+    exec_cache_init(profile["exec-cache"], profile["sandbox"])
+
+    run_chat_only(profile, llm_config, args.keep)
+
     logger.info("Exiting GDB")
     gdb_exit()
     logger.info("Exiting LSP")
     lsp_exit()
-
-    if args.keep:
-        keep_log(profile)
@@ -0,0 +1,248 @@
+import io
+import json
+import os
+import socketserver
+import sys
+import threading
+import time
+
+from agent.functions import reset_state
+from build import run_build
+from fix_localization import run_fix_localization
+from patch_generation import run_patch_generation
+from shared.arguments import get_run_id, load_job, parse_args_daemon
+from shared.consts import (
+    LOCALIZATION_OUTPUT,
+    LOCALIZATION_SNAPSHOT,
+    PATCH_OUTPUT,
+    PATCH_SNAPSHOT,
+)
+from shared.utils import get_logger, reset_log_files
+from tools.exec_cache import exec_cache_init
+from tools.gdb_integration import GdbWrapperFactory, gdb_attach
+from tools.lsp_cache import lsp_cache_init
+from tools.lsp_integration import LspWrapperFactory, lsp_attach
+from validate import run_validation
+
+logger = get_logger(__name__)
+
+RESULT_FILE = "validate.lock"
+
+
+class ToolSet:
+    """
+    GDB and LSP factories of a project, whose instances are kept alive
+    between jobs of the same profile.
+    """
+
+    def __init__(self, profile) -> None:
+        self.signature = ToolSet.get_signature(profile)
+        self.gdb = GdbWrapperFactory(
+            profile["run"],
+            profile["args"],
+            profile["env"],
+            profile["work"],
+            profile["timeout"],
+            profile["core-cache"],
+            profile["checkpoint"],
+            profile["gdb-index"],
+            profile["gdb-pool"],
+        )
+        self.lsp = LspWrapperFactory(
+            cwd=profile["sandbox"], index_timeout=profile["index-timeout"]
+        )
+
+    @staticmethod
+    def get_signature(profile):
+        keys = ["run", "args", "env", "work", "timeout", "core-cache", "checkpoint"]
+        keys += ["gdb-index", "gdb-pool", "sandbox", "index-timeout"]
+        return json.dumps([profile[key] for key in keys])
+
+    def exit(self):
+        self.gdb.close()
+        self.lsp.respawn()
+
+
+class RepairDaemon:
+    """
+    Run the whole repair pipeline in one process, so that GDB, the language
+    server and the caches stay warm across stages and jobs. Jobs are run one
+    at a time, as tools are shared through global instances.
+    """
+
+    def __init__(self) -> None:
+        self._tools = {}  # profile -> ToolSet
+        self._lsp_cache = False  # directory of the current LSP cache
+        self._exec_cache = None  # (directory, sandbox) of the execution cache
+
+    def _attach(self, profile):
+        name = profile["profile"]
+        tools = self._tools.get(name, None)
+        if tools is not None and tools.signature != ToolSet.get_signature(profile):
+            logger.info(f"Profile {name} changed, restarting GDB and LSP")
+            tools.exit()
+            tools = None
+        if tools is None:
+            tools = ToolSet(profile)
+            self._tools[name] = tools
+        gdb_attach(tools.gdb)
+        lsp_attach(tools.lsp)
+
+        if self._lsp_cache != profile["lsp-cache"]:
+            lsp_cache_init(profile["lsp-cache"])
+            self._lsp_cache = profile["lsp-cache"]
+        exec_cache = (profile["exec-cache"], profile["sandbox"])
+        if self._exec_cache != exec_cache:
+            exec_cache_init(*exec_cache)
+            self._exec_cache = exec_cache
+        return tools
+
+    def _run_stage(self, name, stage, *args):
+        """
+        Run a stage as the scripts do with `echo exit |`, return False if it
+        exits with error.
+        """
+        logger.info(f"Running {name}")
+        sys.stdin = io.StringIO("exit\n")
+        try:
+            stage(*args)
+        except SystemExit as e:
+            if e.code not in [None, 0]:
+                logger.error(f"{name} failed")
+                return False
+        finally:
+            sys.stdin = sys.__stdin__
+        return True
+
+    def _run_once(self, job, rerun):
+        """
+        Run fix localization, patch generation and validation once,
+        return the result of validation, or None on failure.
+        """
+        keep = job.get("keep", False)
+
+        def _load():
+            return load_job(
+                job["profile"],
+                job.get("config", "config.yaml"),
+                job.get("no_constraint", False),
+                rerun,
+            )
+
+        profile, llm_config = _load()
+        tools = self._attach(profile)
+
+        tools.gdb.reset()
+        if not self._run_stage(
+            "Fix Localization", run_fix_localization, profile, llm_config, keep
+        ):
+            return None
+
+        profile, llm_config = _load()
+        tools.gdb.reset()
+        if not self._run_stage(
+            "Patch Generation", run_patch_generation, profile, llm_config, keep
+        ):
+            return None
+
+        profile, _ = _load()
+        tools.gdb.reset()
+        return run_validation(profile, keep)
+
+    def run(self, job):
+        """
+        Run a repair job, which is the same as scripts/run_agent.sh.
+        """
+        start = time.time()
+        reset_log_files()
+        reset_state()
+        # stages of the job keep their logs in the same run
+        os.environ["RUN_ID"] = get_run_id()
+        for filename in [
+            LOCALIZATION_OUTPUT,
+            LOCALIZATION_SNAPSHOT,
+            PATCH_OUTPUT,
+            PATCH_SNAPSHOT,
+            RESULT_FILE,
+        ]:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+        response = {"profile": job["profile"]}
+        profile, _ = load_job(
+            job["profile"],
+            job.get("config", "config.yaml"),
+            job.get("no_constraint", False),
+        )
+        logger.info(f"Preparing workspace for {profile['profile']}")
+        if not run_build(profile):
+            response["result"] = "error"
+        else:
+            for rerun in [False, True]:
+                result = self._run_once(job, rerun)
+                if result is None:
+                    response["result"] = "error"
+                    break
+                response["result"] = result
+                if result == "valid":
+                    break
+                logger.warning("Failed, attempt to retry" if not rerun else "Failed")
+
+        response["duration"] = "{:.2f}s".format(time.time() - start)
+        return response
+
+    def exit(self):
+        for tools in self._tools.values():
+            tools.exit()
+        self._tools = {}
+
+
+class RepairRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Each request is a line of JSON, which is either a job with profile,
+    config, keep and no_constraint, or {"command": "shutdown"}. The response
+    is also a line of JSON.
+    """
+
+    def handle(self):
+        line = self.rfile.readline()
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError:
+            self._respond({"result": "error", "error": "Invalid request"})
+            return
+
+        if request.get("command", None) == "shutdown":
+            self._respond({"result": "shutdown"})
+            # shutdown() waits for serve_forever() in this thread
+            threading.Thread(target=self.server.shutdown).start()
+            return
+
+        try:
+            response = self.server.repair.run(request)
+        except Exception as e:
+            logger.error(f"Job terminated with exception: {e}")
+            response = {"result": "error", "error": str(e)}
+        self._respond(response)
+
+    def _respond(self, response):
+        self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+
+
+if __name__ == "__main__":
+    args = parse_args_daemon()
+
+    if os.path.exists(args.socket):
+        os.remove(args.socket)
+    daemon = RepairDaemon()
+    with socketserver.UnixStreamServer(args.socket, RepairRequestHandler) as server:
+        server.repair = daemon
+        logger.info(f"Listening on {args.socket}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+    logger.info("Exiting GDB and LSP")
+    daemon.exit()
+    os.remove(args.socket)
@@ -1,14 +1,16 @@
 import json
 import os
-import shutil
 
 from agent.agent import agent_init_fl
 from shared.arguments import parse_args_fl
 from shared.consts import LOCALIZATION_OUTPUT, LOCALIZATION_SNAPSHOT
 from shared.prompt import FL_CONSTRAINT, FL_IGNORE_LOCATIONS, FL_INITIAL_MESSAGE
+from shared.store import store_artifacts
 from shared.utils import get_duration, get_logger
+from tools.exec_cache import exec_cache_init
 from tools.gdb_integration import gdb_exit, gdb_init
-from tools.lsp_integration import lsp_exit, lsp_init
+from tools.lsp_cache import lsp_cache_init
+from tools.lsp_integration import lsp_exit, lsp_index_time, lsp_init
 
 logger = get_logger(__name__, log_file="fl.log")
 
@@ -29,23 +31,23 @@ def load_locations():
 
 
 def keep_log(profile):
-    if not os.path.exists(f"log/{profile['profile']}"):
-        os.makedirs(f"log/{profile['profile']}")
-
-    shutil.copyfile(
-        LOCALIZATION_SNAPSHOT, f"log/{profile['profile']}/{LOCALIZATION_SNAPSHOT}"
-    )
-    shutil.copyfile("fl.log", f"log/{profile['profile']}/fl.log")
-    shutil.copyfile("function.log", f"log/{profile['profile']}/fl_function.log")
-    shutil.copyfile("gdb.log", f"log/{profile['profile']}/gdb.log")
-    shutil.copyfile(
-        LOCALIZATION_OUTPUT, f"log/{profile['profile']}/{LOCALIZATION_OUTPUT}"
+    store_artifacts(
+        profile,
+        {
+            LOCALIZATION_SNAPSHOT: LOCALIZATION_SNAPSHOT,
+            "fl.log": "fl.log",
+            "fl_function.log": "function.log",
+            "gdb.log": "gdb.log",
+            "sanitizer.log": "sanitizer.log",
+            LOCALIZATION_OUTPUT: LOCALIZATION_OUTPUT,
+        },
     )
 
 
-if __name__ == "__main__":
-    args, profile, llm_config = parse_args_fl()
-
+def run_fix_localization(profile, llm_config, keep=False):
+    """
+    Run fix localization, GDB and LSP should be initialized.
+    """
     # log of essential information
     snapshot = {"profile": profile}
 
@@ -58,16 +60,6 @@ if __name__ == "__main__":
         logger.error(f"Executable {profile['run']} not found, forget to build?")
         exit(1)
 
-    logger.info("Initializing GDB")
-    gdb_init(
-        profile["run"],
-        profile["args"],
-        profile["env"],
-        profile["work"],
-    )
-    logger.info("Initializing LSP")
-    lsp_init(cwd=profile["sandbox"])
-
     logger.info("Initializing agent")
     assistant, user_proxy, system_message = agent_init_fl(llm_config, profile)
 
@@ -114,15 +106,41 @@ if __name__ == "__main__":
             }
         snapshot["locations"] = locations
 
+        index_time = lsp_index_time()
+        if index_time is not None:
+            snapshot["index_time"] = "{:.2f}s".format(index_time)
         snapshot["duration"] = "{:.2f}s".format(get_duration(profile))
         with open(LOCALIZATION_SNAPSHOT, "w") as f:
             f.write(json.dumps(snapshot, indent=4))
 
+    if keep:
+        keep_log(profile)
+
+
+if __name__ == "__main__":
+    args, profile, llm_config = parse_args_fl()
+
+    logger.info("Initializing GDB")
+    gdb_init(
+        profile["run"],
+        profile["args"],
+        profile["env"],
+        profile["work"],
+        profile["timeout"],
+        profile["core-cache"],
+        profile["checkpoint"],
+        profile["gdb-index"],
+        profile["gdb-pool"],
+    )
+    logger.info("Initializing LSP")
+    lsp_init(cwd=profile["sandbox"], index_timeout=profile["index-timeout"])
+    lsp_cache_init(profile["lsp-cache"])
+    exec_cache_init(profile["exec-cache"], profile["sandbox"])
+
+    run_fix_localization(profile, llm_config, args.keep)
+
     # Terminate GDB and LSP.
     logger.info("Exiting GDB")
     gdb_exit()
     logger.info("Exiting LSP")
     lsp_exit()
-
-    if args.keep:
-        keep_log(profile)
@@ -1,15 +1,20 @@
 import json
 import os
-import shutil
 
 from agent.agent import agent_init_pg
-from agent.functions import set_validate_callback, validate
+from agent.functions import set_validate_callback, set_validate_pool, validate
+from agent.validator import ValidatorPool
 from shared.arguments import parse_args_pg
 from shared.consts import PATCH_INPUT, PATCH_OUTPUT, PATCH_SNAPSHOT
 from shared.prompt import PG_CONSTRAINT, PG_INITIAL_MESSAGE
+from shared.store import store_artifacts
 from shared.utils import get_duration, get_logger
+from tools.ccache_integration import ccache_stats, ccache_zero_stats
+from tools.exec_cache import exec_cache_init
 from tools.gdb_integration import gdb_exit, gdb_init
-from tools.lsp_integration import lsp_exit, lsp_init
+from tools.lsp_cache import lsp_cache_init
+from tools.lsp_integration import lsp_exit, lsp_index_time, lsp_init
+from tools.tools import editor_diff
 
 logger = get_logger(__name__, log_file="pg.log")
 
@@ -30,35 +35,27 @@ def load_locations():
 
 
 def keep_log(profile):
-    if not os.path.exists(f"log/{profile['profile']}"):
-        os.makedirs(f"log/{profile['profile']}")
-
-    shutil.copyfile(PATCH_SNAPSHOT, f"log/{profile['profile']}/{PATCH_SNAPSHOT}")
-    shutil.copyfile("pg.log", f"log/{profile['profile']}/pg.log")
-    shutil.copyfile("function.log", f"log/{profile['profile']}/pg_function.log")
-    shutil.copyfile(PATCH_OUTPUT, f"log/{profile['profile']}/{PATCH_OUTPUT}")
-
+    store_artifacts(
+        profile,
+        {
+            PATCH_SNAPSHOT: PATCH_SNAPSHOT,
+            "pg.log": "pg.log",
+            "pg_function.log": "function.log",
+            PATCH_OUTPUT: PATCH_OUTPUT,
+        },
+    )
 
-if __name__ == "__main__":
-    args, profile, llm_config = parse_args_pg()
 
+def run_patch_generation(profile, llm_config, keep=False):
+    """
+    Run patch generation, GDB and LSP should be initialized.
+    """
     # log of essential information
     snapshot = {"profile": profile}
 
     locations = load_locations()
     snapshot["locations"] = locations
 
-    logger.info("Initializing GDB")
-    gdb_init(
-        profile["run"],
-        profile["args"],
-        profile["env"],
-        profile["work"],
-    )
-
-    logger.info("Initializing LSP")
-    lsp_init(cwd=profile["sandbox"])
-
     logger.info("Initializing agent")
     assistant, user_proxy, system_message = agent_init_pg(llm_config, profile)
 
@@ -71,6 +68,11 @@ if __name__ == "__main__":
 
     # set validate callback
     set_validate_callback(lambda: validate(logger, profile))
+    if profile["validate-workers"] > 1:
+        set_validate_pool(ValidatorPool(profile, profile["validate-workers"], logger))
+    else:
+        set_validate_pool(None)
+    ccache_zero_stats(profile["ccache"])
 
     chat_result = None
     try:
@@ -101,16 +103,48 @@ if __name__ == "__main__":
         else:
             patch = {"failed": "Failed to generate patch, see snapshot['error']"}
         snapshot["patch"] = json.loads(patch)
-
+        # changes kept in the sandbox, i.e. the validated patch
+        snapshot["diff"] = editor_diff(profile["sandbox"])
+
+        stats = ccache_stats(profile["ccache"])
+        if stats is not None:
+            snapshot["ccache"] = stats
+        index_time = lsp_index_time()
+        if index_time is not None:
+            snapshot["index_time"] = "{:.2f}s".format(index_time)
         snapshot["duration"] = "{:.2f}s".format(get_duration(profile))
         with open(PATCH_SNAPSHOT, "w") as f:
             f.write(json.dumps(snapshot, indent=4))
 
+    if keep:
+        keep_log(profile)
+
+
+if __name__ == "__main__":
+    args, profile, llm_config = parse_args_pg()
+
+    logger.info("Initializing GDB")
+    gdb_init(
+        profile["run"],
+        profile["args"],
+        profile["env"],
+        profile["work"],
+        profile["timeout"],
+        profile["core-cache"],
+        profile["checkpoint"],
+        profile["gdb-index"],
+        profile["gdb-pool"],
+    )
+
+    logger.info("Initializing LSP")
+    lsp_init(cwd=profile["sandbox"], index_timeout=profile["index-timeout"])
+    lsp_cache_init(profile["lsp-cache"])
+    exec_cache_init(profile["exec-cache"], profile["sandbox"])
+
+    run_patch_generation(profile, llm_config, args.keep)
+
     # Terminate GDB and LSP.
     logger.info("Exiting GDB")
     gdb_exit()
     logger.info("Exiting LSP")
     lsp_exit()
-
-    if args.keep:
-        keep_log(profile)
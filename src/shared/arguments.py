@@ -36,13 +36,25 @@ def _load_llm_config(filename="config.yaml"):
     return config
 
 
-def _load_profile(filename):
+def find_profile(filename):
+    """
+    Find the profile by its path or name, which may be in profile.d.
+    """
     if not filename.endswith(".json"):
         filename += ".json"
     if not os.path.exists(filename):
         filename = os.path.join("profile.d", filename)
     if not os.path.exists(filename):
         raise FileNotFoundError(f"Profile {filename} not found")
+    return filename
+
+
+def get_run_id():
+    return datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+
+
+def _load_profile(filename):
+    filename = find_profile(filename)
     with open(filename, "r") as f:
         profile = json.load(f)
 
@@ -89,34 +101,103 @@ def _load_profile(filename):
     if not _contains(profile, "mode"):
         profile["mode"] = "gdb"
 
+    if not _contains(profile, "cache"):
+        profile["cache"] = ".cache"
+    profile["cache"] = os.path.abspath(profile["cache"])
+
+    if not _contains(profile, "lsp-cache") or not profile["lsp-cache"]:
+        profile["lsp-cache"] = None
+    else:
+        profile["lsp-cache"] = os.path.join(profile["cache"], "lsp")
+    if not _contains(profile, "ccache") or not profile["ccache"]:
+        profile["ccache"] = None
+    else:
+        profile["ccache"] = os.path.join(profile["cache"], "ccache")
+
+    # outcomes of runs, disabled for programs that do not behave the same
+    if _contains(profile, "exec-cache") and not profile["exec-cache"]:
+        profile["exec-cache"] = None
+    else:
+        profile["exec-cache"] = os.path.join(profile["cache"], "exec")
+
+    if not _contains(profile, "core-cache") or not profile["core-cache"]:
+        profile["core-cache"] = None
+    else:
+        profile["core-cache"] = os.path.join(profile["cache"], "cores")
+
+    # number of GDB instances started in background
+    if not _contains(profile, "gdb-pool"):
+        profile["gdb-pool"] = 0
+    # symbol index of binaries generated by GDB
+    profile["gdb-index"] = os.path.join(profile["cache"], "gdb-index")
+
+    # location to snapshot the program at in GDB, e.g. "main" or "file.c:42"
+    if not _contains(profile, "checkpoint"):
+        profile["checkpoint"] = None
+
+    if not _contains(profile, "incremental"):
+        profile["incremental"] = False
+
+    if not _contains(profile, "validate-workers"):
+        profile["validate-workers"] = 1
+
+    if not _contains(profile, "index-timeout"):
+        profile["index-timeout"] = 300
+
+    # seconds to wait for GDB commands, and for the program to stop
+    timeout = {"command": 5, "run": 60, "sanitizer": 60, "cpu": 60}
+    if _contains(profile, "timeout"):
+        timeout.update(profile["timeout"])
+    profile["timeout"] = timeout
+
+    if not _contains(profile, "log"):
+        profile["log"] = "log"
+    profile["log"] = os.path.abspath(profile["log"])
+
     # add profile identifier
     if not _contains(profile, "profile"):
         profile["profile"] = os.path.splitext(os.path.basename(filename))[0]
 
     # get current system time
     profile["timestamp"] = str(datetime.datetime.now())
+    # stages of the same run share the identifier given by RUN_ID
+    profile["run-id"] = os.environ.get("RUN_ID", "") or get_run_id()
 
     return profile
 
 
-def _parse_args(parser):
-    args = parser.parse_args()
-    args_dict = vars(args)
-
-    profile = _load_profile(args.profile)
-    llm_config = _load_llm_config(args.config)
+def load_job(profile, config="config.yaml", no_constraint=False, rerun=None):
+    """
+    Load the profile and LLM config of a job, the same way as the command
+    line arguments of each stage.
+    """
+    profile = _load_profile(profile)
+    llm_config = _load_llm_config(config)
 
-    if "no_constraint" in args_dict:
-        if args.no_constraint:
-            # force disable constraint
-            profile["constraint"] = None
-    if "rerun" in args_dict:
-        profile["rerun"] = args.rerun
+    if no_constraint:
+        # force disable constraint
+        profile["constraint"] = None
+    if rerun is not None:
+        profile["rerun"] = rerun
 
     profile["profile"] += f"-{llm_config['model']}"
     if profile["constraint"] is None:
         profile["profile"] += "-nc"
 
+    return profile, llm_config
+
+
+def _parse_args(parser):
+    args = parser.parse_args()
+    args_dict = vars(args)
+
+    profile, llm_config = load_job(
+        args.profile,
+        args.config,
+        args_dict.get("no_constraint", False),
+        args_dict.get("rerun", None),
+    )
+
     return args, profile, llm_config
 
 
@@ -332,3 +413,218 @@ def parse_args_validate():
     )
 
     return _parse_args(parser)
+
+
+def parse_args_daemon():
+    """
+    -s, --socket: socket to listen on
+    """
+    parser = argparse.ArgumentParser(
+        prog="Daemon",
+        description="Serve repair jobs with GDB and LSP kept warm",
+        epilog="Enjoy the program! :)",
+    )
+    parser.add_argument(
+        "-s",
+        "--socket",
+        type=str,
+        required=False,
+        default="repair.sock",
+        help="Socket to listen on",
+    )
+
+    return parser.parse_args()
+
+
+def parse_args_submit():
+    """
+    -s, --socket: socket of the daemon
+    -c, --config: configuration file
+    -p, --profile: project profile
+    --keep: keep the log after execution
+    --no-constraint: disable constraint
+    --shutdown: stop the daemon
+    """
+    parser = argparse.ArgumentParser(
+        prog="Submit",
+        description="Submit a repair job to the daemon",
+        epilog="Enjoy the program! :)",
+    )
+    parser.add_argument(
+        "-s",
+        "--socket",
+        type=str,
+        required=False,
+        default="repair.sock",
+        help="Socket of the daemon",
+    )
+    parser.add_argument(
+        "-c",
+        "--config",
+        type=str,
+        required=False,
+        default="config.yaml",
+        help="Configuration file",
+    )
+    parser.add_argument(
+        "-p",
+        "--profile",
+        type=str,
+        required=False,
+        help="Project profile",
+    )
+    parser.add_argument(
+        "-k",
+        "--keep",
+        action="store_true",
+        required=False,
+        default=False,
+        help="Keep the log after execution",
+    )
+    parser.add_argument(
+        "--no-constraint",
+        action="store_true",
+        required=False,
+        default=False,
+        help="Disable constraint",
+    )
+    parser.add_argument(
+        "--shutdown",
+        action="store_true",
+        required=False,
+        default=False,
+        help="Stop the daemon",
+    )
+
+    args = parser.parse_args()
+    if args.profile is None and not args.shutdown:
+        parser.error("the following arguments are required: -p/--profile")
+    return args
+
+
+def parse_args_batch():
+    """
+    -p, --profiles: file of profiles to run
+    -c, --config: configuration file
+    -j, --jobs: number of runs at the same time
+    -o, --output: directory of run directories
+    --timeout: time limit of each stage in seconds
+    --memory: memory limit of each stage in MiB
+    --no-constraint: disable constraint
+    """
+    parser = argparse.ArgumentParser(
+        prog="Batch Run",
+        description="Repair multiple projects in parallel",
+        epilog="Enjoy the program! :)",
+    )
+    parser.add_argument(
+        "-p",
+        "--profiles",
+        type=str,
+        required=True,
+        help="File of profiles to run",
+    )
+    parser.add_argument(
+        "-c",
+        "--config",
+        type=str,
+        required=False,
+        default="config.yaml",
+        help="Configuration file",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        required=False,
+        default=1,
+        help="Number of runs at the same time",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        required=False,
+        default="runs",
+        help="Directory of run directories",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=int,
+        required=False,
+        default=None,
+        help="Time limit of each stage in seconds",
+    )
+    parser.add_argument(
+        "--memory",
+        type=int,
+        required=False,
+        default=None,
+        help="Address space limit of each stage in MiB, too low for sanitizers",
+    )
+    parser.add_argument(
+        "--no-constraint",
+        action="store_true",
+        required=False,
+        default=False,
+        help="Disable constraint",
+    )
+
+    return parser.parse_args()
+
+
+def parse_args_artifacts():
+    """
+    -l, --log: root of the log store
+    -p, --profile: only runs of the profile
+    -r, --run: run to show
+    -a, --artifact: artifact of the run to print
+    -o, --output: write the artifact to file instead
+    """
+    parser = argparse.ArgumentParser(
+        prog="Artifacts",
+        description="Query the log store of runs",
+        epilog="Enjoy the program! :)",
+    )
+    parser.add_argument(
+        "-l",
+        "--log",
+        type=str,
+        required=False,
+        default="log",
+        help="Root of the log store",
+    )
+    parser.add_argument(
+        "-p",
+        "--profile",
+        type=str,
+        required=False,
+        default=None,
+        help="Only runs of the profile",
+    )
+    parser.add_argument(
+        "-r",
+        "--run",
+        type=str,
+        required=False,
+        default=None,
+        help="Run to show",
+    )
+    parser.add_argument(
+        "-a",
+        "--artifact",
+        type=str,
+        required=False,
+        default=None,
+        help="Artifact of the run to print",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        required=False,
+        default=None,
+        help="Write the artifact to file instead",
+    )
+
+    return parser.parse_args()
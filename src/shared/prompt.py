@@ -17,6 +17,7 @@ FL_SYSTEM = (
     "- `run_to_line`: Run the program in GDB until the specified line, so that you can get the real state of the program there.\n"
     # "- `switch_frame`: Switch to the specified stack frame to inspect the variables.\n"
     "- `print_value`: Get the real value of a variable or array element at the current context.\n"
+    "- `print_values`: Get the real values of several expressions at once, in the current or the given stack frame, and optionally all arguments and locals there.\n"
     "**Language Server Functions**:\n"
     "- `definition`: Get the definition of a symbol in the code.\n"
     "- `summary`: Retrieve a summary of a symbol (e.g., function or variable).\n"
@@ -29,13 +30,13 @@ FL_SYSTEM = (
     "1. Call `run_program` once to get the crash stacktrace and the crashed stack frame. "
     "If the program does not crash, call `confirm_location()` with two None arguments and stop. "
     "Otherwise, synthesize the constraint at crash site based on the given constraint and crash information. "
-    "Then, call `print_value` one or more times to inspect the real value of variables at crash site and compare it with the expected state. "
+    "Then, call `print_values` with all variables of interest at crash site at once to inspect their real values and compare them with the expected state. "
     "After you have enough information about the crash site, go to step 2.\n"
     "2. Call `run_to_line` to get the real state of the program at a specified line in the current stack frame before crash. "
     "The line should be chosen based on the control and data flow from the crash location, usually at branches or loops, e.g. if, for, switch, etc. "
     "You don't need to call it at the crash location, but call it backwards from the crash location to get the expected state of the program. "
     "After each call to `run_to_line`, synthesize the constraint and expected state of the program here based on the constraint at other lines and output a summary. "
-    "Then call `print_value` one or more times to inspect the related variables and compare it with the expected state.\n"
+    "Then call `print_values` with all the related variables at once to inspect them and compare them with the expected state.\n"
     "3. Repeat step 2 at least two times to get more comprehensive understanding of the change of the program state.\n"
     # "4. If a suitable fix location cannot be found in the crashed stack frame, you can call `switch_frame` to switch to other stack frames and repeat 2 and 3. "
     # "You can only switch to the given stack frames, and the available stack frames may change after each `run_to_line`.\n"
@@ -138,6 +139,11 @@ PG_SYSTEM = (
     "Otherwirse, it will return an error message, and you should provide another patch again.\n"
 )
 
+PG_PARALLEL = (
+    "If you are not sure which patch is correct, you can call `confirm_patches()` instead with a list of at most {} alternative patches, each in the same format as above. "
+    "They will be validated at the same time, and the first valid one in the list will be accepted.\n"
+)
+
 PG_INITIAL_MESSAGE = (
     "The root cause of the bug is summarized as follows: {}\n"
     "And the possible fix locations are provided as follows in the format of <filename>:<start line>-<end line>:\n{}"
@@ -0,0 +1,131 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Dict
+
+# size of chunks to hash and compress artifacts
+CHUNK_SIZE = 1 << 20
+
+
+class ArtifactStore:
+    """
+    Store of run artifacts. Each artifact is written once, compressed, under
+    objects/ by the hash of its content, and each run keeps a small manifest
+    under runs/<profile>/ mapping artifact names to hashes.
+    """
+
+    def __init__(self, root) -> None:
+        self._root = root
+        self._objects = os.path.join(root, "objects")
+        self._runs = os.path.join(root, "runs")
+
+    def object_path(self, digest):
+        return os.path.join(self._objects, digest[:2], digest + ".gz")
+
+    def manifest_path(self, profile, run):
+        return os.path.join(self._runs, profile, run + ".json")
+
+    def put(self, filename):
+        """
+        Add a file to the store, return the hash of its content.
+        """
+        os.makedirs(self._objects, exist_ok=True)
+        hasher = hashlib.sha256()
+        fd, temp = tempfile.mkstemp(dir=self._objects, suffix=".tmp")
+        try:
+            with open(filename, "rb") as src, open(fd, "wb") as raw:
+                # fixed mtime so that the same content is compressed the same
+                with gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as dest:
+                    while True:
+                        chunk = src.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        hasher.update(chunk)
+                        dest.write(chunk)
+            digest = hasher.hexdigest()
+            path = self.object_path(digest)
+            if os.path.exists(path):
+                os.remove(temp)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp, path)
+        except BaseException:
+            if os.path.exists(temp):
+                os.remove(temp)
+            raise
+        return digest
+
+    def open(self, digest):
+        """
+        Open an artifact by its hash for reading in binary mode.
+        """
+        return gzip.open(self.object_path(digest), "rb")
+
+    def load_manifest(self, profile, run):
+        path = self.manifest_path(profile, run)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def save(self, profile, run, artifacts: Dict[str, str], meta=None):
+        """
+        Add artifacts to the manifest of the run, artifacts are given as
+        name -> filename, and missing files are skipped. Meta is merged into
+        the manifest.
+        """
+        manifest = self.load_manifest(profile, run)
+        if manifest is None:
+            manifest = {"profile": profile, "run": run, "artifacts": {}}
+        if meta is not None:
+            manifest.update(meta)
+        for name, filename in artifacts.items():
+            if not os.path.exists(filename):
+                continue
+            manifest["artifacts"][name] = {
+                "hash": self.put(filename),
+                "size": os.path.getsize(filename),
+            }
+
+        path = self.manifest_path(profile, run)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            f.write(json.dumps(manifest, indent=4))
+        os.replace(path + ".tmp", path)
+        return manifest
+
+    def runs(self, profile=None):
+        """
+        Get manifests of all runs, or runs of the given profile, in the order
+        of run identifiers.
+        """
+        if not os.path.isdir(self._runs):
+            return []
+        profiles = [profile] if profile is not None else os.listdir(self._runs)
+        manifests = []
+        for name in sorted(profiles):
+            directory = os.path.join(self._runs, name)
+            if not os.path.isdir(directory):
+                continue
+            for filename in sorted(os.listdir(directory)):
+                if filename.endswith(".json"):
+                    manifests.append(self.load_manifest(name, filename[:-5]))
+        return manifests
+
+    def export(self, digest, filename):
+        """
+        Decompress an artifact to the given file.
+        """
+        with self.open(digest) as src, open(filename, "wb") as dest:
+            shutil.copyfileobj(src, dest, CHUNK_SIZE)
+
+
+def store_artifacts(profile, artifacts: Dict[str, str], meta=None):
+    """
+    Keep artifacts of the current run in the log store of the profile.
+    """
+    store = ArtifactStore(profile["log"])
+    return store.save(profile["profile"], profile["run-id"], artifacts, meta)
@@ -1,10 +1,16 @@
 import datetime
+import fcntl
+import hashlib
+import json
 import logging
 import os
 import shutil
 
 import coloredlogs
 
+# ioctl to share data blocks between files on btrfs, xfs, etc.
+FICLONE = 0x40049409
+
 
 def get_logger(name, level=logging.INFO, log_file=None):
     log_formatter = logging.Formatter(
@@ -27,6 +33,32 @@ def get_logger(name, level=logging.INFO, log_file=None):
     return logger
 
 
+def reset_log_files():
+    """
+    Truncate all log files opened by loggers, so that a long-running process
+    only keeps the logs of the current job.
+    """
+    loggers = [logging.getLogger()]
+    loggers += [
+        logger
+        for logger in logging.Logger.manager.loggerDict.values()
+        if isinstance(logger, logging.Logger)
+    ]
+    for logger in loggers:
+        for handler in logger.handlers:
+            if not isinstance(handler, logging.FileHandler):
+                continue
+            if handler.stream is None:
+                continue
+            handler.acquire()
+            try:
+                handler.flush()
+                handler.stream.seek(0)
+                handler.stream.truncate()
+            finally:
+                handler.release()
+
+
 def get_duration(profile):
     """
     get duration in seconds from profile
@@ -36,6 +68,19 @@ def get_duration(profile):
     return duration.total_seconds()
 
 
+def get_project_cache(profile, name):
+    """
+    Get the cache directory of the given name for the project of the profile.
+    Projects are identified by the hash of their project and sandbox path, so
+    that cached data referring to absolute paths stays valid.
+    """
+    identity = f"{profile['project']}:{profile['sandbox']}"
+    digest = hashlib.sha1(identity.encode("utf-8")).hexdigest()[:16]
+    directory = os.path.join(profile["cache"], name, digest)
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
 def ensure_empty_dir(directory: str):
     """
     Ensure that the directory is empty.
@@ -63,4 +108,98 @@ def copy_dir_content(src: str, dest: str):
             dest_dir = os.path.dirname(dest_file)
             if not os.path.exists(dest_dir):
                 os.makedirs(dest_dir)
-            shutil.copy2(src_file, dest_file)
+            copy_file(src_file, dest_file)
+
+
+def copy_file(src: str, dest: str):
+    """
+    Copy a file with its metadata like shutil.copy2. The copy is a reflink
+    if the filesystem supports it, which costs no extra space or I/O.
+    Different from hardlinks, modifying the copy does not affect the source.
+    """
+    if os.path.lexists(dest):
+        os.remove(dest)
+    try:
+        with open(src, "rb") as fsrc, open(dest, "wb") as fdest:
+            fcntl.ioctl(fdest.fileno(), FICLONE, fsrc.fileno())
+    except OSError:
+        shutil.copyfile(src, dest)
+    shutil.copystat(src, dest)
+
+
+def _get_stamp(path: str):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _get_hash(path: str):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def sync_dir_content(src: str, dest: str, manifest_file: str):
+    """
+    Incrementally sync the content of src directory to dest directory.
+    The manifest records (size, mtime, hash) of synced files, so that only
+    files changed in src or modified in dest are copied, and files removed
+    from src are deleted. Other files in dest, e.g. build outputs, are kept.
+    Returns the number of copied and deleted files.
+    """
+    old = {}
+    if os.path.exists(manifest_file):
+        with open(manifest_file, "r") as f:
+            old = json.load(f)
+    new = {}
+
+    copied = 0
+    for root, _, files in os.walk(src):
+        for file in files:
+            src_file = os.path.join(root, file)
+            rel = os.path.relpath(src_file, src)
+            dest_file = os.path.join(dest, rel)
+            src_stamp = _get_stamp(src_file)
+            dest_stamp = _get_stamp(dest_file)
+
+            record = old.get(rel, None)
+            if record is not None and record["dest"] == dest_stamp:
+                if record["src"] == src_stamp:
+                    new[rel] = record
+                    continue
+                # touched in src, compare the content with the last copy
+                digest = _get_hash(src_file)
+                if record["hash"] is None:
+                    record["hash"] = _get_hash(dest_file)
+                if digest == record["hash"]:
+                    new[rel] = {"src": src_stamp, "dest": dest_stamp, "hash": digest}
+                    continue
+
+            dest_dir = os.path.dirname(dest_file)
+            if not os.path.exists(dest_dir):
+                os.makedirs(dest_dir)
+            copy_file(src_file, dest_file)
+            if dest_stamp is not None:
+                # newer than previous build outputs, so that it is rebuilt
+                os.utime(dest_file)
+            copied += 1
+
+            # hash is computed lazily, only when the file is touched
+            new[rel] = {"src": src_stamp, "dest": _get_stamp(dest_file), "hash": None}
+
+    deleted = 0
+    for rel in old.keys() - new.keys():
+        dest_file = os.path.join(dest, rel)
+        if os.path.exists(dest_file):
+            os.remove(dest_file)
+            deleted += 1
+
+    os.makedirs(os.path.dirname(manifest_file), exist_ok=True)
+    with open(manifest_file, "w") as f:
+        json.dump(new, f)
+
+    return copied, deleted
@@ -0,0 +1,42 @@
+import json
+import socket
+
+from shared.arguments import parse_args_submit
+
+RESULT_FILE = "validate.lock"
+
+
+def submit(socket_file, request):
+    """
+    Send a request to the daemon and wait for the response.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_file)
+        client.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        with client.makefile("r") as f:
+            return json.loads(f.readline())
+
+
+if __name__ == "__main__":
+    args = parse_args_submit()
+
+    if args.shutdown:
+        submit(args.socket, {"command": "shutdown"})
+        exit(0)
+
+    response = submit(
+        args.socket,
+        {
+            "profile": args.profile,
+            "config": args.config,
+            "keep": args.keep,
+            "no_constraint": args.no_constraint,
+        },
+    )
+    print(json.dumps(response, indent=4))
+
+    # same as scripts/run_agent.sh, so that batch scripts can use it
+    if response["result"] in ["valid", "invalid"]:
+        with open(RESULT_FILE, "w") as f:
+            f.write(response["result"])
+    exit(0 if response["result"] != "error" else 1)
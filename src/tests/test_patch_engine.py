@@ -0,0 +1,133 @@
+import os
+import tempfile
+import time
+import unittest
+
+from tools.patch_engine import PatchEngine, PieceTable
+
+
+class PieceTableTest(unittest.TestCase):
+    def test_line_offset(self):
+        table = PieceTable("a\nbb\nccc\n")
+        self.assertEqual(table.line_offset(1), 0)
+        self.assertEqual(table.line_offset(2), 2)
+        self.assertEqual(table.line_offset(3), 5)
+        self.assertEqual(table.line_offset(4), 9)
+        self.assertEqual(table.line_offset(10), 9)
+
+    def test_line_offset_after_replace(self):
+        table = PieceTable("a\nbb\nccc\n")
+        old = table.replace(2, 5, "x\ny\n")
+        self.assertEqual(old, "bb\n")
+        self.assertEqual(table.get_text(), "a\nx\ny\nccc\n")
+        self.assertEqual(table.line_offset(3), 4)
+        self.assertEqual(table.line_offset(4), 6)
+        self.assertEqual(table.get_text(4, 8), "y\ncc")
+
+    def test_copy(self):
+        table = PieceTable("a\nb\n")
+        copy = table.copy()
+        copy.replace(0, 1, "x")
+        self.assertEqual(table.get_text(), "a\nb\n")
+        self.assertEqual(copy.get_text(), "x\nb\n")
+
+
+class PatchEngineTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.engine = PatchEngine()
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _write(self, name, text):
+        filename = os.path.join(self._dir.name, name)
+        with open(filename, "w") as f:
+            f.write(text)
+        return filename
+
+    def _read(self, filename):
+        with open(filename, "r") as f:
+            return f.read()
+
+    def test_multi_hunk_apply_and_restore(self):
+        a = self._write("a.c", "1\n2\n3\n4\n5\n")
+        b = self._write("b.c", "x\ny\n")
+        self.engine.mark(a)
+        self.engine.mark(b)
+        # line numbers refer to the files before the transaction
+        self.engine.apply(
+            [
+                (a, 2, 2, "two\n"),
+                (a, 4, 3, "inserted\n"),
+                (a, 5, 5, ""),
+                (b, 1, 1, "X\nX\n"),
+            ]
+        )
+        self.assertEqual(self._read(a), "1\ntwo\n3\ninserted\n4\n")
+        self.assertEqual(self._read(b), "X\nX\ny\n")
+
+        self.engine.apply([(a, 1, 1, "one\n")])
+        self.assertEqual(self._read(a), "one\ntwo\n3\ninserted\n4\n")
+
+        self.engine.restore(a)
+        self.engine.restore(b)
+        self.assertEqual(self._read(a), "1\n2\n3\n4\n5\n")
+        self.assertEqual(self._read(b), "x\ny\n")
+
+    def test_insert_at_end_of_file(self):
+        a = self._write("a.c", "1\n2")
+        self.engine.mark(a)
+        applied = self.engine.apply([(a, 3, 2, "3\n")])
+        self.assertEqual(self._read(a), "1\n2\n3\n")
+        self.assertEqual(applied[a], [(3, 2, "\n3\n", True)])
+        self.engine.restore(a)
+        self.assertEqual(self._read(a), "1\n2")
+
+    def test_overlapping_hunks(self):
+        a = self._write("a.c", "1\n2\n3\n")
+        self.engine.mark(a)
+        with self.assertRaises(ValueError):
+            self.engine.apply([(a, 1, 2, "x\n"), (a, 2, 3, "y\n")])
+        with self.assertRaises(ValueError):
+            self.engine.apply([(a, 2, 1, "x\n"), (a, 2, 1, "y\n")])
+        with self.assertRaises(ValueError):
+            self.engine.apply([(a, 3, 1, "x\n")])
+        # nothing is written by a rejected transaction
+        self.assertEqual(self._read(a), "1\n2\n3\n")
+
+    def test_restore_after_external_modification(self):
+        a = self._write("a.c", "1\n2\n3\n")
+        self.engine.mark(a)
+        self.engine.apply([(a, 2, 2, "two\n")])
+        # make sure the stamp changes
+        time.sleep(0.01)
+        self._write("a.c", "changed\noutside\n")
+        self.engine.restore(a)
+        self.assertEqual(self._read(a), "1\n2\n3\n")
+
+    def test_restore_not_marked(self):
+        a = self._write("a.c", "1\n")
+        with self.assertRaises(FileNotFoundError):
+            self.engine.restore(a)
+
+    def test_diff(self):
+        a = self._write("a.c", "1\n2")
+        self.engine.mark(a)
+        self.assertEqual(self.engine.diff(self._dir.name), "")
+        self.engine.apply([(a, 2, 2, "3")])
+        self.assertEqual(
+            self.engine.diff(self._dir.name),
+            "--- a/a.c\n"
+            "+++ b/a.c\n"
+            "@@ -1,2 +1,2 @@\n"
+            " 1\n"
+            "-2\n"
+            "\\ No newline at end of file\n"
+            "+3\n"
+            "\\ No newline at end of file\n",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,186 @@
+import unittest
+
+from tools.sanitizer_integration import SanitizerParser, parse_sanitizer_output
+
+ASAN = """\
+=================================================================
+==12345==ERROR: AddressSanitizer: heap-buffer-overflow on address 0x602000000014 at pc 0x0000004f2a3b bp 0x7ffd0f6e0a10 sp 0x7ffd0f6e0a08
+READ of size 4 at 0x602000000014 thread T0
+    #0 0x4f2a3b in sum /src/sample/main.c:7:16
+    #1 0x4f2b1c in main /src/sample/main.c:15:5
+    #2 0x7f0e1c02409a in __libc_start_main (/lib/x86_64-linux-gnu/libc.so.6+0x2409a)
+    #3 0x41c2f9 in _start (/src/sample/main+0x41c2f9)
+
+0x602000000014 is located 0 bytes to the right of 4-byte region [0x602000000010,0x602000000014)
+allocated by thread T0 here:
+    #0 0x4ba5b2 in malloc (/src/sample/main+0x4ba5b2)
+    #1 0x4f2a9e in main /src/sample/main.c:12:14
+
+SUMMARY: AddressSanitizer: heap-buffer-overflow /src/sample/main.c:7:16 in sum
+Shadow bytes around the buggy address:
+==12345==ABORTING
+"""
+
+UBSAN = """\
+/src/sample/main.c:7:16: runtime error: signed integer overflow: 2147483647 + 1 cannot be represented in type 'int'
+    #0 0x4f2a3b in sum /src/sample/main.c:7:16
+    #1 0x4f2b1c in main /src/sample/main.c:15:5
+    #2 0x7f0e1c02409a in __libc_start_main (/lib/x86_64-linux-gnu/libc.so.6+0x2409a)
+
+SUMMARY: UndefinedBehaviorSanitizer: undefined-behavior /src/sample/main.c:7:16 in
+"""
+
+TSAN = """\
+==================
+WARNING: ThreadSanitizer: data race (pid=4242)
+  Write of size 4 at 0x7b0400000000 by thread T1:
+    #0 worker /src/sample/race.c:6:11 (race+0x4b3c5)
+
+  Previous write of size 4 at 0x7b0400000000 by main thread:
+    #0 main /src/sample/race.c:14:11 (race+0x4b41d)
+
+  Location is heap block of size 4 at 0x7b0400000000 allocated by main thread:
+    #0 malloc <null> (race+0x2e8a1)
+    #1 main /src/sample/race.c:11:16 (race+0x4b3fb)
+
+  Thread T1 (tid=4244, running) created by main thread at:
+    #0 pthread_create <null> (race+0x2f98b)
+    #1 main /src/sample/race.c:13:3 (race+0x4b412)
+
+SUMMARY: ThreadSanitizer: data race /src/sample/race.c:6:11 in worker
+==================
+ThreadSanitizer: reported 1 warnings
+"""
+
+LSAN = """\
+
+=================================================================
+==777==ERROR: LeakSanitizer: detected memory leaks
+
+Direct leak of 8 byte(s) in 1 object(s) allocated from:
+    #0 0x4ba5b2 in malloc (/src/sample/leak+0x4ba5b2)
+    #1 0x4f2a9e in make /src/sample/leak.c:4:12
+    #2 0x4f2b1c in main /src/sample/leak.c:9:3
+
+Indirect leak of 16 byte(s) in 2 object(s) allocated from:
+    #0 0x4ba5b2 in malloc (/src/sample/leak+0x4ba5b2)
+    #1 0x4f2aa0 in make /src/sample/leak.c:5:14
+
+SUMMARY: AddressSanitizer: 24 byte(s) leaked in 3 allocation(s).
+"""
+
+MSAN = """\
+==999==WARNING: MemorySanitizer: use-of-uninitialized-value
+    #0 0x49a5e1 in check /src/sample/uninit.c:5:7
+    #1 0x49a6b2 in main /src/sample/uninit.c:12:3
+    #2 0x7f0e1c02409a in __libc_start_main (/lib/x86_64-linux-gnu/libc.so.6+0x2409a)
+
+  Uninitialized value was created by an allocation of 'x' in the stack frame of function 'main'
+    #0 0x49a620 in main /src/sample/uninit.c:9
+
+SUMMARY: MemorySanitizer: use-of-uninitialized-value /src/sample/uninit.c:5:7 in check
+Exiting
+"""
+
+
+class SanitizerParserTest(unittest.TestCase):
+    def _parse_one(self, output):
+        reports = parse_sanitizer_output(output)
+        self.assertEqual(len(reports), 1)
+        return reports[0]
+
+    def test_asan(self):
+        report = self._parse_one(ASAN)
+        self.assertEqual(report.kind, "AddressSanitizer")
+        self.assertEqual(report.error, "heap-buffer-overflow")
+        self.assertEqual(
+            report.access,
+            {
+                "type": "READ",
+                "size": 4,
+                "address": "0x602000000014",
+                "thread": "thread T0",
+                "line": "READ of size 4 at 0x602000000014 thread T0",
+            },
+        )
+        self.assertEqual(len(report.frames), 4)
+        self.assertEqual(report.frames[0]["func"], "sum")
+        self.assertEqual(report.frames[0]["file"], "/src/sample/main.c")
+        self.assertEqual(report.frames[0]["line"], 7)
+        self.assertEqual(report.frames[0]["column"], 16)
+        self.assertIsNone(report.frames[2]["file"])
+        self.assertEqual(
+            report.frames[2]["module"], "/lib/x86_64-linux-gnu/libc.so.6"
+        )
+        self.assertEqual([f["func"] for f in report.allocation], ["malloc", "main"])
+        self.assertEqual(report.location(), ("/src/sample/main.c", 7))
+        self.assertEqual(report.location("main"), ("/src/sample/main.c", 15))
+        self.assertTrue(report.summary.startswith("SUMMARY: AddressSanitizer"))
+
+    def test_ubsan(self):
+        report = self._parse_one(UBSAN)
+        self.assertEqual(report.kind, "UndefinedBehaviorSanitizer")
+        self.assertTrue(report.error.startswith("signed integer overflow"))
+        self.assertEqual((report.filename, report.line), ("/src/sample/main.c", 7))
+        self.assertEqual(len(report.frames), 3)
+        self.assertEqual(report.location("main"), ("/src/sample/main.c", 15))
+
+    def test_ubsan_without_stack(self):
+        report = self._parse_one(
+            "a.c:3:5: runtime error: division by zero\nnot a report\n"
+        )
+        self.assertEqual(report.frames, [])
+        self.assertEqual(report.location(), ("a.c", 3))
+
+    def test_tsan(self):
+        report = self._parse_one(TSAN)
+        self.assertEqual(report.kind, "ThreadSanitizer")
+        self.assertEqual(report.error, "data race")
+        self.assertEqual(report.access["type"], "WRITE")
+        self.assertEqual(report.access["thread"], "thread T1")
+        self.assertEqual(report.frames[0]["func"], "worker")
+        self.assertEqual(report.frames[0]["module"], "race")
+        self.assertEqual(report.location(), ("/src/sample/race.c", 6))
+        self.assertEqual(report.allocation[1]["line"], 11)
+        titles = [title for title, _ in report.related]
+        self.assertEqual(len(titles), 2)
+        self.assertTrue(titles[0].startswith("Previous write of size 4"))
+        self.assertTrue(titles[1].startswith("Thread T1"))
+        self.assertEqual(report.related[0][1][0]["func"], "main")
+
+    def test_lsan(self):
+        report = self._parse_one(LSAN)
+        self.assertEqual(report.kind, "LeakSanitizer")
+        self.assertEqual(report.error, "detected memory leaks")
+        self.assertEqual(report.access["type"], "direct leak")
+        self.assertEqual(report.access["size"], 8)
+        self.assertEqual(report.location("make"), ("/src/sample/leak.c", 4))
+        self.assertEqual(len(report.related), 1)
+        self.assertTrue(report.related[0][0].startswith("Indirect leak"))
+        self.assertEqual(len(report.related[0][1]), 2)
+
+    def test_msan(self):
+        report = self._parse_one(MSAN)
+        self.assertEqual(report.kind, "MemorySanitizer")
+        self.assertEqual(report.error, "use-of-uninitialized-value")
+        self.assertIsNone(report.access)
+        self.assertEqual(report.location(), ("/src/sample/uninit.c", 5))
+        self.assertEqual(report.allocation[0]["line"], 9)
+
+    def test_feed_in_chunks(self):
+        output = (ASAN + UBSAN).encode("utf-8")
+        parser = SanitizerParser()
+        reports = []
+        for start in range(0, len(output), 7):
+            reports += parser.feed(output[start : start + 7])
+        # reports are complete at their SUMMARY
+        self.assertEqual(
+            [r.kind for r in reports],
+            ["AddressSanitizer", "UndefinedBehaviorSanitizer"],
+        )
+        self.assertEqual(len(reports[1].frames), 3)
+        self.assertEqual(parser.close(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import shutil
+import subprocess
+
+# directories of compiler symlinks to ccache on common distributions
+_MASQUERADE_DIRS = [
+    "/usr/lib/ccache",
+    "/usr/lib64/ccache",
+    "/usr/local/opt/ccache/libexec",
+]
+
+# counters of `ccache --print-stats`
+_HIT_COUNTERS = ["direct_cache_hit", "preprocessed_cache_hit"]
+_MISS_COUNTERS = ["cache_miss"]
+
+
+def is_ccache_available(executable="ccache"):
+    return shutil.which(executable) is not None
+
+
+def ccache_env(cache_dir, basedir, env=None):
+    """
+    Get the environment to build with compilers wrapped by ccache, so that
+    only translation units with changed content are compiled again.
+    Objects are stored in cache_dir, and paths under basedir are rewritten
+    to relative ones, so that copies of the sandbox share the cache.
+    Return None if cache_dir is None or ccache is not available, which means
+    to inherit the current environment.
+    """
+    if cache_dir is None or not is_ccache_available():
+        return None
+
+    env = dict(os.environ if env is None else env)
+    env["CCACHE_DIR"] = cache_dir
+    env["CCACHE_BASEDIR"] = basedir
+    env["CCACHE_NOHASHDIR"] = "1"
+    env["CCACHE_COMPILERCHECK"] = "content"
+
+    # compilers invoked by name in the build scripts
+    for directory in _MASQUERADE_DIRS:
+        if os.path.isdir(directory):
+            env["PATH"] = directory + os.pathsep + env.get("PATH", "")
+            break
+    # compilers taken from the environment by make, configure and cmake
+    for key, default in [("CC", "cc"), ("CXX", "c++")]:
+        compiler = env.get(key, default)
+        if not compiler.startswith("ccache"):
+            env[key] = f"ccache {compiler}"
+
+    return env
+
+
+def ccache_zero_stats(cache_dir):
+    if cache_dir is None or not is_ccache_available():
+        return
+    subprocess.run(
+        ["ccache", "--zero-stats"],
+        env=dict(os.environ, CCACHE_DIR=cache_dir),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def ccache_stats(cache_dir):
+    """
+    Get hit/miss statistics of the cache since last zeroed.
+    Return None if not available.
+    """
+    if cache_dir is None or not is_ccache_available():
+        return None
+    process = subprocess.run(
+        ["ccache", "--print-stats"],
+        env=dict(os.environ, CCACHE_DIR=cache_dir),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    if process.returncode != 0:
+        # --print-stats is only available since ccache 4
+        return None
+
+    counters = {}
+    for line in process.stdout.decode("utf-8").split("\n"):
+        fields = line.split("\t")
+        if len(fields) == 2 and fields[1].isdigit():
+            counters[fields[0]] = int(fields[1])
+    hits = sum(counters.get(key, 0) for key in _HIT_COUNTERS)
+    misses = sum(counters.get(key, 0) for key in _MISS_COUNTERS)
+    return {"hits": hits, "misses": misses}
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+
+import diskcache
+
+_FILE_HASHES = {}  # filename -> (stamp, hash)
+
+
+def hash_file(filename):
+    """
+    Get the content hash of a file, cached until it is modified.
+    """
+    stat = os.stat(filename)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    cached = _FILE_HASHES.get(filename, None)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    hasher = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            hasher.update(chunk)
+    _FILE_HASHES[filename] = (stamp, hasher.hexdigest())
+    return _FILE_HASHES[filename][1]
+
+
+def hash_dir(directory):
+    """
+    Get the hash of the manifest of a directory, which is the content hash
+    of every file under it.
+    """
+    files = []
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            if not os.path.isfile(path):
+                continue
+            files.append([os.path.relpath(path, directory), hash_file(path)])
+    files.sort()
+    return hashlib.sha1(json.dumps(files).encode("utf-8")).hexdigest()
+
+
+def _normalize(value, roots):
+    """
+    Replace the root prefix of a path with the name of the root, so that
+    the same run in a copy of the sandbox has the same key.
+    """
+    for root, name in roots:
+        if value == root or value.startswith(root + os.sep):
+            return name + value[len(root) :]
+    return value
+
+
+class ExecCache:
+    """
+    Cache of run outcomes. Entries are keyed on the content hash of the
+    executable, the arguments, the environment, the content of the working
+    directory and the mode of the run, so that an identical run is done only
+    once. Paths under the sandbox and the working directory are keyed
+    relative to them, so that runs in clones of the sandbox share entries.
+    Without a directory the cache is disabled, e.g. for programs that do not
+    behave the same on each run.
+    """
+
+    def __init__(self, directory=None, sandbox=None) -> None:
+        self._sandbox = sandbox
+        self._disk = None
+        if directory is not None:
+            self._disk = diskcache.Cache(directory)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, cmd, cwd, env, mode, sandbox=None):
+        """
+        Get the key of running cmd in cwd with env, or None if the cache is
+        disabled or the executable does not exist. Sandbox is the one the
+        executable is built in, by default the sandbox of the cache.
+        """
+        if self._disk is None or not os.path.exists(cmd[0]):
+            return None
+        roots = [(cwd, "<work>")]
+        sandbox = sandbox or self._sandbox
+        if sandbox is not None:
+            roots.append((sandbox, "<sandbox>"))
+        args = [_normalize(arg, roots) for arg in cmd[1:]]
+        env = {key: _normalize(value, roots) for key, value in env.items()}
+        identity = [hash_file(cmd[0]), args, env, hash_dir(cwd), mode]
+        return hashlib.sha1(json.dumps(identity).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Get the outcome of the key, or None if not cached.
+        """
+        if key is None:
+            return None
+        value = self._disk.get(key, None)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        if key is not None:
+            self._disk.set(key, value)
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
+
+
+######################################################################
+# Execution cache instance management
+
+EXEC_CACHE = ExecCache()
+
+
+def exec_cache_init(directory=None, sandbox=None):
+    global EXEC_CACHE
+    EXEC_CACHE.close()
+    EXEC_CACHE = ExecCache(directory, sandbox)
+    return EXEC_CACHE
+
+
+def exec_cache_instance():
+    return EXEC_CACHE
@@ -1,11 +1,137 @@
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import re
+from array import array
+from collections import OrderedDict
+
+# files larger than this are memory-mapped instead of read into memory
+MMAP_THRESHOLD = 1 << 20
+# maximum number of files kept in the cache
+CACHE_CAPACITY = 256
+
+# tokens of C/C++ that may contain identifier-like text, and identifiers
+_C_TOKEN = re.compile(
+    r"//[^\n]*"  # line comment
+    r"|/\*.*?(?:\*/|$)"  # block comment
+    r'|"(?:\\.|[^"\\\n])*"'  # string literal
+    r"|'(?:\\.|[^'\\\n])*'"  # character literal
+    r"|\d[\w.]*"  # number
+    r"|([A-Za-z_][A-Za-z0-9_]*)",  # identifier
+    re.DOTALL,
+)
+
+
+class FileEntry:
+    """
+    Cached content of a file with the offset of each line, so that a range of
+    lines can be sliced without reading the whole file again.
+    """
+
+    def __init__(self, filename, stamp) -> None:
+        self.stamp = stamp
+        with open(filename, "rb") as f:
+            if stamp[1] >= MMAP_THRESHOLD:
+                self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                self._data = f.read()
+
+        # offsets[i] is the start of line i + 1, the last one is the end of file
+        self._offsets = array("Q", [0])
+        self._offsets.extend(m.end() for m in re.finditer(b"\n", self._data))
+        size = len(self._data)
+        if self._offsets[-1] != size:
+            self._offsets.append(size)
+        self._hash = None
+        self._identifiers = None
+
+    def line_count(self):
+        return len(self._offsets) - 1
+
+    def get_lines(self, start_line, end_line):
+        """
+        Get lines from start_line to end_line (both inclusive), which must be
+        a valid range.
+        """
+        data = self._data[self._offsets[start_line - 1] : self._offsets[end_line]]
+        return data.decode("utf-8", errors="replace").replace("\r\n", "\n")
+
+    def get_hash(self):
+        if self._hash is None:
+            self._hash = hashlib.sha1(self._data).hexdigest()
+        return self._hash
+
+    def get_identifiers(self):
+        """
+        Get the positions of identifiers outside comments and literals, as
+        identifier -> sorted list of (line, column), both 1-based.
+        """
+        if self._identifiers is not None:
+            return self._identifiers
+
+        text = self.get_lines(1, self.line_count()) if self.line_count() > 0 else ""
+        starts = [0]
+        starts.extend(m.end() for m in re.finditer("\n", text))
+        identifiers = {}
+        line = 1
+        for m in _C_TOKEN.finditer(text):
+            if m.group(1) is None:
+                continue
+            pos = m.start()
+            if line < len(starts) and starts[line] <= pos:
+                line = bisect.bisect_right(starts, pos, line)
+            column = pos - starts[line - 1] + 1
+            identifiers.setdefault(m.group(1), []).append((line, column))
+        self._identifiers = identifiers
+        return identifiers
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+
+
+_FILE_CACHE = OrderedDict()  # filename -> FileEntry
+
+
+def file_get_entry(filename: str) -> FileEntry:
+    """
+    Get the cached entry of a file, which is reloaded if the file is modified.
+    Raise FileNotFoundError if the file does not exist.
+    """
+    stat = os.stat(filename)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    entry = _FILE_CACHE.get(filename, None)
+    if entry is not None and entry.stamp == stamp:
+        _FILE_CACHE.move_to_end(filename)
+        return entry
+
+    file_invalidate(filename)
+    entry = FileEntry(filename, stamp)
+    _FILE_CACHE[filename] = entry
+    while len(_FILE_CACHE) > CACHE_CAPACITY:
+        _, evicted = _FILE_CACHE.popitem(last=False)
+        evicted.close()
+    return entry
+
+
+def file_invalidate(filename: str):
+    """
+    Drop the cached entry of a file. Must be called before the file is
+    modified in place, as the entry may be memory-mapped.
+    """
+    entry = _FILE_CACHE.pop(filename, None)
+    if entry is not None:
+        entry.close()
+
+
 def file_get_line_count(filename: str):
     """
     Get the number of lines in a file.
     Return -1 if the file does not exist.
     """
-    with open(filename, "r") as f:
-        lines = f.readlines()
-    return len(lines)
+    return file_get_entry(filename).line_count()
 
 
 def file_get_content(filename: str, start_line: int, end_line: int):
@@ -13,14 +139,13 @@ def file_get_content(filename: str, start_line: int, end_line: int):
     Get the content of a file from start_line to end_line (both inclusive).
     Return empty string if the file does not exist or the range is invalid.
     """
-    with open(filename, "r") as f:
-        lines = f.readlines()
-    end_line = min(end_line, len(lines) - 1)
+    entry = file_get_entry(filename)
+    end_line = min(end_line, entry.line_count() - 1)
     if start_line < 1:
         start_line = 1
     if end_line < start_line:
         return ""
-    return "".join(lines[start_line - 1 : end_line])
+    return entry.get_lines(start_line, end_line)
 
 
 def file_get_decorated_content(filename: str, start_line: int, end_line: int):
@@ -28,14 +153,163 @@ def file_get_decorated_content(filename: str, start_line: int, end_line: int):
     Get the content of a file from start_line to end_line (both inclusive)
     with line_number in each line.
     """
-    with open(filename, "r") as f:
-        lines = f.readlines()
-    end_line = min(end_line, len(lines) - 1)
+    entry = file_get_entry(filename)
+    end_line = min(end_line, entry.line_count() - 1)
     if start_line < 1:
         start_line = 1
     if end_line < start_line:
         return ""
-    content = ""
-    for i, line in enumerate(lines[start_line - 1 : end_line], start_line):
-        content += f"{i:3} {line}"
-    return content
+    content = []
+    for i in range(start_line, end_line + 1):
+        content.append(f"{i:3} {entry.get_lines(i, i)}")
+    return "".join(content)
+
+
+def file_get_hash(filename: str):
+    """
+    Get the content hash of a file, which is cached until the file is modified.
+    Return None if the file does not exist.
+    """
+    try:
+        return file_get_entry(filename).get_hash()
+    except FileNotFoundError:
+        return None
+
+
+class PathIndex:
+    """
+    Index of files under a directory by basename, to resolve relative or
+    partial paths reported by GDB or sanitizers without walking the whole
+    directory. Only directories modified since the last scan are rescanned.
+    """
+
+    def __init__(self, root) -> None:
+        self._root = root
+        self._dirs = {}  # relative dir -> (mtime, files, subdirs)
+        self._basenames = {}  # basename -> set of relative paths
+        self._preferred = set()
+        self._compile_commands_stamp = None
+        self._scan("")
+
+    def _scan(self, reldir):
+        path = os.path.join(self._root, reldir)
+        files = set()
+        subdirs = set()
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.add(os.path.join(reldir, entry.name))
+                    elif entry.is_file():
+                        files.add(entry.name)
+        except (FileNotFoundError, NotADirectoryError):
+            return
+        self._dirs[reldir] = (mtime, files, subdirs)
+        for name in files:
+            self._basenames.setdefault(name, set()).add(os.path.join(reldir, name))
+        for subdir in subdirs:
+            if subdir not in self._dirs:
+                self._scan(subdir)
+
+    def _drop(self, reldir):
+        mtime, files, subdirs = self._dirs.pop(reldir)
+        for name in files:
+            paths = self._basenames.get(name, None)
+            if paths is not None:
+                paths.discard(os.path.join(reldir, name))
+        return subdirs
+
+    def refresh(self):
+        """
+        Rescan directories modified since the last scan.
+        """
+        for reldir in list(self._dirs.keys()):
+            if reldir not in self._dirs:
+                # dropped along with its parent
+                continue
+            try:
+                mtime = os.stat(os.path.join(self._root, reldir)).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime == self._dirs[reldir][0]:
+                continue
+            old_subdirs = self._drop(reldir)
+            self._scan(reldir)
+            new_subdirs = self._dirs[reldir][2] if reldir in self._dirs else set()
+            for subdir in old_subdirs - new_subdirs:
+                self._drop_tree(subdir)
+
+    def _drop_tree(self, reldir):
+        if reldir not in self._dirs:
+            return
+        for subdir in self._drop(reldir):
+            self._drop_tree(subdir)
+
+    def _load_preferred(self):
+        """
+        Files listed in compile_commands.json are preferred for ambiguous
+        basenames, as they are the ones actually built.
+        """
+        compile_commands = os.path.join(self._root, "compile_commands.json")
+        try:
+            stat = os.stat(compile_commands)
+        except FileNotFoundError:
+            return
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self._compile_commands_stamp:
+            return
+        self._compile_commands_stamp = stamp
+        with open(compile_commands, "r") as f:
+            commands = json.load(f)
+        self._preferred = set()
+        for command in commands:
+            path = os.path.join(command["directory"], command["file"])
+            self._preferred.add(os.path.relpath(os.path.normpath(path), self._root))
+
+    def _lookup(self, filename):
+        parts = os.path.normpath(filename).split(os.sep)
+        candidates = self._basenames.get(parts[-1], None)
+        if not candidates:
+            return None
+
+        def _rank(candidate):
+            candidate_parts = candidate.split(os.sep)
+            matched = 0
+            for a, b in zip(reversed(parts), reversed(candidate_parts)):
+                if a != b:
+                    break
+                matched += 1
+            preferred = candidate in self._preferred
+            return (-matched, not preferred, len(candidate_parts), candidate)
+
+        self._load_preferred()
+        return os.path.join(self._root, min(candidates, key=_rank))
+
+    def find(self, filename):
+        """
+        Find the file under root that best matches the given path, which is
+        the one with the longest matching suffix. Return None if not found.
+        """
+        if os.path.isabs(filename):
+            filename = os.path.relpath(filename, self._root)
+        path = self._lookup(filename)
+        if path is None or not os.path.exists(path):
+            self.refresh()
+            path = self._lookup(filename)
+        return path
+
+
+_PATH_INDEXES = {}  # root -> PathIndex
+
+
+def file_find(root: str, filename: str):
+    """
+    Find the file under root by its (partial) path.
+    Return None if not found.
+    """
+    index = _PATH_INDEXES.get(root, None)
+    if index is None:
+        index = PathIndex(root)
+        _PATH_INDEXES[root] = index
+    return index.find(filename)
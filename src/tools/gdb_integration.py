@@ -1,22 +1,247 @@
+import bisect
+import hashlib
+import json
 import logging
 import os
+import re
+import resource
+import select
+import signal
 import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List
 
 from pygdbmi.gdbcontroller import GdbController
 
+from tools.exec_cache import exec_cache_instance, hash_dir, hash_file
+from tools.sanitizer_integration import SanitizerParser, parse_sanitizer_output
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 logger.addHandler(logging.FileHandler("gdb.log", "w"))
 
+# seconds to wait for a command to complete, for the program to stop, and
+# wall-clock and CPU time of runs without GDB
+DEFAULT_TIMEOUT = {"command": 5, "run": 60, "sanitizer": 60, "cpu": 60}
+
+# stderr of runs without GDB is streamed to this file
+SANITIZER_LOG = "sanitizer.log"
+# bytes of stderr kept in memory, the rest is only in the spool file
+OUTPUT_LIMIT = 1 << 20
+# bytes of stderr written to the spool file, the rest is discarded
+SPOOL_LIMIT = 64 << 20
+# sanitizers which stop the program on a report, others, e.g. UBSan, may
+# recover from it and go on
+FATAL_SANITIZERS = ["AddressSanitizer", "MemorySanitizer", "LeakSanitizer"]
+
 
 def _parse_gdb_output(output):
-    response = ""
+    response = []
+    for message in output:
+        if message["type"] in ["console", "target", "output"]:
+            response.append(message["payload"])
+
+    return "".join(response)
+
+
+def _quote(value):
+    """
+    Quote a value as a C string for MI commands.
+    """
+    value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{value}"'
+
+
+def _get_result(output):
+    """
+    Get the result record of a command, as (message, payload), message is
+    one of "done", "running", "error", etc.
+    """
+    for message in output:
+        if message["type"] == "result":
+            return message["message"], message["payload"]
+    return None, None
+
+
+def _find_result(output, token):
+    for message in output:
+        if message["type"] == "result" and message["token"] == token:
+            return message["message"]
+    return None
+
+
+def _filter_token(output, token):
+    """
+    Drop records of other commands, e.g. late results of a command that timed
+    out. Records without a token, e.g. console output, are kept.
+    """
+    return [
+        message for message in output if message.get("token", None) in [None, token]
+    ]
+
+
+def _get_stopped(output):
+    """
+    Get the payload of the last stopped record, or None if not stopped.
+    """
+    stopped = None
     for message in output:
-        if message["type"] == "console":
-            response += message["payload"]
+        if message["type"] == "notify" and message["message"] == "stopped":
+            stopped = message["payload"]
+    return stopped
+
+
+def run_bounded(cmd, cwd, env, timeout, cpu=None, spool=None, sandbox=None):
+    """
+    Run a program without GDB, killed after timeout seconds of wall-clock time
+    or cpu seconds of CPU time. Stderr is streamed to the spool file and the
+    sanitizer parser, and the program is stopped early once a complete
+    report of a fatal sanitizer, up to the line of SUMMARY, is captured.
+    Return (reason, returncode, stderr, reports), reason is one of "exited",
+    "report" and "timeout". Outcomes are kept in the execution cache, keyed
+    with paths relative to the sandbox the executable is built in, and an
+    identical run is not done again. Runs killed by the wall-clock limit are
+    not cached, as they depend on the load of the machine. On a cache hit,
+    the spool file only has the stderr kept in memory, at most OUTPUT_LIMIT.
+    """
+    cache = exec_cache_instance()
+    key = cache.key(cmd, cwd, env, ["run", timeout, cpu], sandbox)
+    cached = cache.get(key)
+    if cached is not None:
+        reason, code, output = cached
+        if spool:
+            with open(spool, "w") as f:
+                f.write(output)
+        return reason, code, output, parse_sanitizer_output(output)
+
+    process = subprocess.Popen(
+        cmd,
+        cwd=cwd,
+        env=env,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        # so that children of the program are killed along with it
+        start_new_session=True,
+    )
+    if cpu is not None:
+        resource.prlimit(process.pid, resource.RLIMIT_CPU, (cpu, cpu + 1))
 
-    return response
+    deadline = time.time() + timeout
+    output = bytearray()
+    written = 0
+    parser = SanitizerParser()
+    reports = []
+    reason = None
+    fd = process.stderr.fileno()
+    with open(spool, "wb") if spool else tempfile.TemporaryFile() as f:
+        while reason is None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                reason = "timeout"
+                break
+            ready, _, _ = select.select([fd], [], [], remaining)
+            if not ready:
+                continue
+            chunk = os.read(fd, 1 << 16)
+            if not chunk:
+                break
+            if written < SPOOL_LIMIT:
+                f.write(chunk[: SPOOL_LIMIT - written])
+                written += len(chunk)
+            if len(output) < OUTPUT_LIMIT:
+                output += chunk[: OUTPUT_LIMIT - len(output)]
+            reports += parser.feed(chunk)
+            if any(report.kind in FATAL_SANITIZERS for report in reports):
+                reason = "report"
+
+    if reason is None:
+        # stderr is closed, but the program may still be running
+        try:
+            process.wait(max(0, deadline - time.time()))
+        except subprocess.TimeoutExpired:
+            reason = "timeout"
+    if reason is not None:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    process.stderr.close()
+    process.wait()
+    if reason is None:
+        # killed by the CPU limit
+        reason = "timeout" if process.returncode == -signal.SIGXCPU else "exited"
+    if reason != "report":
+        reports += parser.close()
+    output = output.decode("utf-8", errors="replace")
+    if reason != "timeout" or process.returncode == -signal.SIGXCPU:
+        cache.put(key, (reason, process.returncode, output))
+    return reason, process.returncode, output, reports
+
+
+def classify_run(reason, code, reports):
+    """
+    Classify an outcome of run_bounded() as "exited-normally", "exited",
+    "sanitizer" or "timeout". A program exiting with 0 exits normally, even
+    if it recovered from reports.
+    """
+    if reason == "timeout":
+        return "timeout"
+    if code == 0:
+        return "exited-normally"
+    if len(reports) > 0 or code in [134, -signal.SIGABRT]:
+        return "sanitizer"
+    return "exited"
+
+
+def run_passed(reason, mode):
+    """
+    Check whether a run classified by classify_run() passes the POC in the
+    run mode. Without GDB, the POC passes unless it times out or crashes,
+    e.g. an input refused with a non-zero exit code passes, while in GDB mode
+    the program must exit normally.
+    """
+    if mode.lower() == "gdb":
+        return reason == "exited-normally"
+    return reason not in ["sanitizer", "timeout"]
+
+
+_CHECKPOINT = re.compile(r"checkpoint (\d+):")
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _unwrap(item, key):
+    """
+    Named values in MI lists, e.g. [frame={...}], may be kept or dropped.
+    """
+    if isinstance(item, dict) and key in item and isinstance(item[key], dict):
+        return item[key]
+    return item
+
+
+def _to_frame(payload, args=None):
+    """
+    Convert a frame of MI to a frame with typed fields:
+    level, func, file, fullname, line, addr and args, file, fullname and
+    line are None if there is no debug information.
+    """
+    return {
+        "level": _to_int(payload.get("level", 0)),
+        "func": payload.get("func", "??"),
+        "file": payload.get("file", None),
+        "fullname": payload.get("fullname", None),
+        "line": _to_int(payload.get("line", None)),
+        "addr": payload.get("addr", None),
+        "args": args if args is not None else payload.get("args", []),
+    }
 
 
 class GdbWrapper:
@@ -26,124 +251,718 @@ class GdbWrapper:
         args: List[str],
         env: Dict[str, str],
         cwd=os.getcwd(),
+        timeout: Dict[str, int] = None,
+        core_dir=None,
+        checkpoint=None,
+        index_dir=None,
     ) -> None:
         assert os.path.exists(executable)
         assert os.path.exists(cwd)
 
+        stat = os.stat(executable)
+        self._stamp = (stat.st_mtime_ns, stat.st_size)
+        self._index_dir = index_dir
         self._controller = GdbController()
         self._executable = executable
         self._args = args
         self._env = env
         self._cwd = cwd
+        self._timeout = dict(DEFAULT_TIMEOUT, **(timeout or {}))
 
         self._running = False
+        self._token = 0
 
-    def _execute(self, cmd):
-        logger.info(cmd)
-        output = _parse_gdb_output(self._controller.write(cmd, timeout_sec=5))
-        logger.info(output)
+        # core dumps of stopped programs, None to always run the program
+        self._core_dir = core_dir
+        self._core_key = None  # key of the core to capture on next stop
+        self._core = False  # whether a core dump is loaded
+
+        # location to snapshot the program at, None to always run from start
+        self._checkpoint_location = checkpoint
+        self._checkpoint = None  # id of the pristine checkpoint
+        self._checkpoint_stamp = None  # stamp of the executable snapshotted
+        self._current = None  # id of the fork being run
+        self._last_reason = None
+
+        self._lines = {}  # file -> (stamp, sorted executable lines)
+
+    def _wait(self, completed, timeout):
+        """
+        Read records as they arrive until completed(records) holds,
+        return (records, completed).
+        """
+        process = self._controller.gdb_process
+        deadline = time.monotonic() + timeout
+        output = []
+        while True:
+            output.extend(
+                self._controller.get_gdb_response(
+                    timeout_sec=0, raise_error_on_timeout=False
+                )
+            )
+            if completed(output):
+                return output, True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or process.poll() is not None:
+                return output, False
+            select.select([process.stdout, process.stderr], [], [], remaining)
+
+    def _execute(self, cmd, timeout=None, until_stopped=False):
+        """
+        Execute a command and return the records of its output, which are
+        complete unless it times out. Records of other commands are dropped.
+        """
+        output, _ = self._execute_with_status(cmd, timeout, until_stopped)
         return output
 
+    def _execute_with_status(self, cmd, timeout=None, until_stopped=False):
+        self._token += 1
+        token = self._token
+        logger.info(cmd)
+        self._controller.write(f"{token}{cmd}", read_response=False)
+        if timeout is None:
+            timeout = self._timeout["command"]
+
+        def _completed(output):
+            result = _find_result(output, token)
+            if result is None:
+                return False
+            if not until_stopped or result == "error":
+                return True
+            return _get_stopped(_filter_token(output, token)) is not None
+
+        output, completed = self._wait(_completed, timeout)
+        output = _filter_token(output, token)
+        logger.info(_parse_gdb_output(output))
+        message, payload = _get_result(output)
+        if message == "error":
+            logger.info(payload.get("msg", ""))
+        if not completed:
+            logger.warning(f"{cmd} did not complete in {timeout}s")
+        return output, completed
+
+    def _execute_batch(self, cmds: List[str], timeout=None):
+        """
+        Execute commands in one write and wait for all of them, return the
+        result record (message, payload) of each command.
+        """
+        tokens = []
+        for _ in cmds:
+            self._token += 1
+            tokens.append(self._token)
+        logger.info("\n".join(cmds))
+        self._controller.write(
+            [f"{token}{cmd}" for token, cmd in zip(tokens, cmds)],
+            read_response=False,
+        )
+        if timeout is None:
+            timeout = self._timeout["command"]
+        output, completed = self._wait(
+            lambda output: all(_find_result(output, t) is not None for t in tokens),
+            timeout,
+        )
+        logger.info(_parse_gdb_output(output))
+        if not completed:
+            logger.warning(f"Commands did not complete in {timeout}s")
+
+        results = {}
+        for message in output:
+            if message["type"] == "result" and message["token"] in tokens:
+                results[message["token"]] = (message["message"], message["payload"])
+        return [results.get(token, (None, None)) for token in tokens]
+
     def start(self):
         # pre-configurations
-        self._execute("set pagination off")
-        self._execute("set confirm off")
-        self._execute("set breakpoint pending on")
+        self._execute("-gdb-set pagination off")
+        self._execute("-gdb-set confirm off")
+        self._execute("-gdb-set breakpoint pending on")
+        if self._index_dir is not None:
+            # symbol index of each binary (by build ID) is generated only once
+            os.makedirs(self._index_dir, exist_ok=True)
+            self._execute(f"set index-cache directory {self._index_dir}")
+            self._execute("set index-cache on")
 
-        return self._execute(f"file {self._executable}")
+        return self._execute(f"-file-exec-and-symbols {_quote(self._executable)}")
+
+    def is_stale(self):
+        """
+        Whether the executable is changed since symbols were loaded.
+        """
+        try:
+            stat = os.stat(self._executable)
+        except FileNotFoundError:
+            return True
+        return (stat.st_mtime_ns, stat.st_size) != self._stamp
 
     def is_running(self):
         return self._running
 
     def run(self):
-        self._execute(f"set cwd {self._cwd}")
+        """
+        Run the program until it stops, return the payload of the stopped
+        record with the output of the program, e.g. reason is one of
+        "exited-normally", "exited", "signal-received" and "breakpoint-hit".
+        If the program does not stop in time, it is interrupted and reason is
+        "timeout", or None if it cannot be interrupted.
+        With a checkpoint location, the program is resumed from the snapshot
+        taken there instead of running from start.
+        """
+        self._drop_core()
+        if self._checkpoint_location is not None:
+            stopped = self._run_from_checkpoint()
+        else:
+            if self._running:
+                self.kill()
+            stopped = self._start()
+        self._last_reason = stopped["reason"]
+        return stopped
+
+    def get_exec_key(self, mode):
+        """
+        Get the key of running the program in the execution cache.
+        """
+        return exec_cache_instance().key(
+            [self._executable] + self._args, self._cwd, self._env, mode
+        )
+
+    def replay(self, stopped):
+        """
+        Take the cached outcome of an identical run as the outcome of this run,
+        which must not leave a program to inspect, e.g. it exited.
+        """
+        if self._running or self._core:
+            self.kill()
+        self._last_reason = stopped["reason"]
+        return stopped
+
+    def _start(self):
+        self._execute(f"-environment-cd {_quote(self._cwd)}")
         for key, value in self._env.items():
             self._execute(f"set environment {key}={value}")
-        cmd = "run"
-        for arg in self._args:
-            cmd += f' "{arg}"'
+        args = " ".join(f'"{arg}"' for arg in self._args)
+        self._execute(f"-exec-arguments {args}")
         self._running = True
-        return self._execute(cmd)
+        return self._resume("-exec-run")
+
+    def _resume(self, cmd):
+        """
+        Run or continue the program until it stops.
+        """
+        output, completed = self._execute_with_status(
+            cmd, self._timeout["run"], until_stopped=True
+        )
+
+        timed_out = False
+        if not completed and _find_result(output, self._token) == "running":
+            # stop the program to inspect where it hangs
+            timed_out = True
+            self._controller.interrupt_gdb()
+            token = self._token
+            more, _ = self._wait(
+                lambda output: _get_stopped(_filter_token(output, token)) is not None,
+                self._timeout["command"],
+            )
+            output.extend(_filter_token(more, token))
+
+        stopped = _get_stopped(output)
+        if stopped is None:
+            stopped = {"reason": None}
+        else:
+            stopped = dict(stopped)
+            if timed_out:
+                stopped["reason"] = "timeout"
+        if stopped["reason"] in ["exited-normally", "exited"]:
+            self._running = False
+        if "frame" in stopped:
+            stopped["frame"] = _to_frame(stopped["frame"])
+        stopped["output"] = _parse_gdb_output(output)
+        return stopped
+
+    def _take_checkpoint(self):
+        """
+        Fork a copy of the stopped program, return its id or None.
+        """
+        match = _CHECKPOINT.search(_parse_gdb_output(self._execute("checkpoint")))
+        if match is None:
+            logger.warning("Failed to take checkpoint")
+            return None
+        return int(match.group(1))
+
+    def _run_from_checkpoint(self):
+        """
+        The pristine checkpoint is never run. To run from it, GDB restarts
+        it, and takes another checkpoint of it before continuing.
+        """
+        stat = os.stat(self._executable)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if self._checkpoint is not None and self._checkpoint_stamp != stamp:
+            # snapshot of the old executable
+            self.kill()
+
+        if self._checkpoint is not None:
+            output = self._execute(f"restart {self._checkpoint}")
+            message, _ = _get_result(output)
+            if message == "error" and self._last_reason not in [
+                "exited-normally",
+                "exited",
+            ]:
+                # GDB switches to the checkpoint when the program exits,
+                # otherwise the current fork is not pristine
+                self.kill()
+            else:
+                if message != "error":
+                    self._execute(f"delete checkpoint {self._current}")
+                self._current = self._checkpoint
+                self._checkpoint = self._take_checkpoint()
+                self._running = True
+                return self._resume("-exec-continue")
+
+        # run to the checkpoint location from start
+        if self._running:
+            self.kill()
+        output = self._execute(
+            f"-break-insert -t -f {_quote(self._checkpoint_location)}"
+        )
+        message, payload = _get_result(output)
+        if message != "done":
+            return self._start()
+        number = _to_int(payload["bkpt"].get("number", None))
+        stopped = self._start()
+        if stopped["reason"] != "breakpoint-hit" or (
+            _to_int(stopped.get("bkptno", None)) != number
+        ):
+            # stopped before the checkpoint location
+            self.delete_breakpoints([number])
+            return stopped
+
+        self._checkpoint = self._take_checkpoint()
+        self._checkpoint_stamp = stamp
+        self._current = 0  # the original process
+        return self._resume("-exec-continue")
+
+    def _get_core_key(self, stop):
+        """
+        Cores are identified by the binary, how it runs, the content of the
+        working directory and where it stops. Contents are hashed rather than
+        stamped, so that files rewritten with the same content by a run keep
+        the key.
+        """
+        identity = [
+            hash_file(self._executable),
+            self._args,
+            self._env,
+            hash_dir(self._cwd),
+            stop,
+        ]
+        return hashlib.sha1(json.dumps(identity).encode("utf-8")).hexdigest()
+
+    def load_core(self, stop):
+        """
+        Load the core dump of the program stopped at stop, which describes
+        where it stops, e.g. "crash" or a breakpoint. Return the stopped record
+        of the run the core was captured from, or None if not cached, in which
+        case the core will be captured by capture_core() after the next run.
+        """
+        self._core_key = None
+        if self._core_dir is None:
+            return None
+        key = self._get_core_key(stop)
+        core = os.path.join(self._core_dir, key + ".core")
+        record = os.path.join(self._core_dir, key + ".json")
+        if not (os.path.exists(core) and os.path.exists(record)):
+            self._core_key = key
+            return None
+
+        if self._running:
+            self.kill()
+        output = self._execute(f"-target-select core {_quote(core)}")
+        message, _ = _get_result(output)
+        if message not in ["done", "connected"]:
+            logger.warning(f"Failed to load core {core}")
+            self._core_key = key
+            return None
+        self._core = True
+        with open(record, "r") as f:
+            stopped = json.load(f)
+        logger.info(f"Loaded core {core}")
+        return stopped
+
+    def capture_core(self, stopped):
+        """
+        Save the core dump of the stopped program for load_core().
+        """
+        key = self._core_key
+        self._core_key = None
+        if key is None or stopped["reason"] not in ["signal-received", "breakpoint-hit"]:
+            return
+        os.makedirs(self._core_dir, exist_ok=True)
+        core = os.path.join(self._core_dir, key + ".core")
+        temp = core + f".{os.getpid()}.tmp"
+        output = self._execute(f"gcore {temp}", self._timeout["run"])
+        message, _ = _get_result(output)
+        if message != "done" or not os.path.exists(temp):
+            logger.warning("Failed to capture core")
+            if os.path.exists(temp):
+                os.remove(temp)
+            return
+        with open(os.path.join(self._core_dir, key + ".json"), "w") as f:
+            f.write(json.dumps(stopped))
+        os.replace(temp, core)
+
+    def _drop_core(self):
+        if self._core:
+            self._execute("core-file")
+            self._core = False
 
     def run_sanitizer(self):
         """
         Sanitizer does not work in GDB, so we provide this function to get the result
-        of the sanitizer. It does not invoke GDB, but runs the executable directly.
-        """
-        cmd = [self._executable]
-        for arg in self._args:
-            cmd.append(arg)
-        process = subprocess.run(
-            cmd,
-            cwd=self._cwd,
-            env=self._env,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
+        of the sanitizer. It does not invoke GDB, but runs the executable directly,
+        bounded by the "sanitizer" and "cpu" timeouts.
+        Return a dict with reason, exit-code, output and reports, reason is one
+        of classify_run().
+        """
+        reason, code, output, reports = run_bounded(
+            [self._executable] + self._args,
+            self._cwd,
+            self._env,
+            self._timeout["sanitizer"],
+            self._timeout["cpu"],
+            SANITIZER_LOG,
         )
-        err_output = process.stderr.decode("utf-8")
-        logger.info(err_output)
-        if process.returncode == 0:
-            return "Program exited normally"
-        if (
-            process.returncode == 134
-            or "ERROR: AddressSanitizer" in err_output
-            or "WARNING: MemorySanitizer" in err_output
-            or "runtime error" in err_output
-        ):
-            return err_output
-        return "Program exited normally, but with non-zero exit code"
+        logger.info(output)
+        reason = classify_run(reason, code, reports)
+        if reason == "timeout":
+            logger.warning(
+                "Program did not finish in {}s".format(self._timeout["sanitizer"])
+            )
+        return {
+            "reason": reason,
+            "exit-code": code,
+            "output": output,
+            "reports": reports,
+        }
+
+    def _list_arguments(self, low=None, high=None):
+        """
+        Get arguments of frames, as level -> [{name, type, value}].
+        """
+        cmd = "-stack-list-arguments --simple-values"
+        if low is not None:
+            cmd += f" {low} {high}"
+        message, payload = _get_result(self._execute(cmd))
+        if message != "done":
+            return {}
+        arguments = {}
+        for item in payload.get("stack-args", []):
+            item = _unwrap(item, "frame")
+            arguments[_to_int(item.get("level", None))] = item.get("args", [])
+        return arguments
 
     def backtrace(self):
-        return self._execute("backtrace")
+        """
+        Get frames of the current thread, from the innermost one.
+        Return an empty list if the program is not stopped.
+        """
+        message, payload = _get_result(self._execute("-stack-list-frames"))
+        if message != "done":
+            return []
+        arguments = self._list_arguments()
+        frames = []
+        for item in payload.get("stack", []):
+            frame = _to_frame(_unwrap(item, "frame"))
+            frame["args"] = arguments.get(frame["level"], [])
+            frames.append(frame)
+        return frames
 
     def frame(self, frame):
-        return self._execute(f"frame {frame}")
+        """
+        Select the frame, return the selected frame or None if not valid.
+        """
+        message, _ = _get_result(self._execute(f"-stack-select-frame {frame}"))
+        if message != "done":
+            return None
+        message, payload = _get_result(self._execute("-stack-info-frame"))
+        if message != "done":
+            return None
+        frame = _to_frame(payload["frame"])
+        frame["args"] = self._list_arguments(frame["level"], frame["level"]).get(
+            frame["level"], []
+        )
+        return frame
 
     def print(self, expression):
-        return self._execute(f"print {expression}")
+        """
+        Evaluate the expression in the selected frame, return (value, error).
+        """
+        output = self._execute(f"-data-evaluate-expression {_quote(expression)}")
+        message, payload = _get_result(output)
+        if message == "done":
+            return payload.get("value", ""), None
+        if message == "error":
+            return None, payload.get("msg", "Unknown error")
+        return None, "No response from GDB"
+
+    def evaluate(self, expressions: List[str], frame=None, variables=False):
+        """
+        Evaluate expressions in the given or the selected frame in one batch,
+        and also list arguments and locals there if variables is set.
+        Return a dict of frame, values as [(expression, value, error)],
+        variables as in variables() or None, and error if the frame is not
+        valid.
+        """
+        cmds = []
+        if frame is not None:
+            cmds.append(f"-stack-select-frame {frame}")
+        cmds.append("-stack-info-frame")
+        for expression in expressions:
+            cmds.append(f"-data-evaluate-expression {_quote(expression)}")
+        if variables:
+            cmds.append("-stack-list-variables --simple-values")
+        results = self._execute_batch(cmds)
+
+        response = {"frame": None, "values": [], "variables": None, "error": None}
+        if frame is not None:
+            message, payload = results.pop(0)
+            if message != "done":
+                response["error"] = (payload or {}).get("msg", "Invalid frame")
+                return response
+        message, payload = results.pop(0)
+        if message == "done":
+            response["frame"] = _to_frame(payload["frame"])
+
+        for expression in expressions:
+            message, payload = results.pop(0)
+            if message == "done":
+                response["values"].append((expression, payload.get("value", ""), None))
+            else:
+                error = (payload or {}).get("msg", "No response from GDB")
+                response["values"].append((expression, None, error))
+
+        if variables:
+            message, payload = results.pop(0)
+            if message == "done":
+                response["variables"] = self._to_variables(payload)
+            else:
+                response["variables"] = []
+        return response
+
+    def _to_variables(self, payload):
+        variables = []
+        for item in payload.get("variables", []):
+            variable = dict(_unwrap(item, "variable"))
+            variable["arg"] = variable.get("arg", "0") == "1"
+            variables.append(variable)
+        return variables
+
+    def variables(self):
+        """
+        Get arguments and locals of the selected frame, as a list of
+        {name, type, value, arg}, value is absent for compound types.
+        """
+        output = self._execute("-stack-list-variables --simple-values")
+        message, payload = _get_result(output)
+        if message != "done":
+            return []
+        return self._to_variables(payload)
+
+    def set_breakpoints(self, file, lines: List[int]):
+        """
+        Insert breakpoints at lines of the file in one batch, return numbers
+        of the inserted ones.
+        """
+        cmds = [f"-break-insert -f {_quote(f'{file}:{line}')}" for line in lines]
+        numbers = []
+        for message, payload in self._execute_batch(cmds):
+            if message == "done":
+                numbers.append(_to_int(payload["bkpt"].get("number", None)))
+        return [number for number in numbers if number is not None]
 
-    def set_breakpoint(self, file, line):
-        return self._execute(f"break {file}:{line}")
+    def executable_lines(self, file, start, end):
+        """
+        Get lines from start to end (both inclusive) of the file that have
+        code, so that breakpoints are only set where the program can stop.
+        Return all lines in the range if the line table is not available.
+        """
+        stat = os.stat(self._executable)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        cached = self._lines.get(file, None)
+        if cached is None or cached[0] != stamp:
+            output = self._execute(f"-symbol-list-lines {_quote(file)}")
+            message, payload = _get_result(output)
+            lines = None
+            if message == "done":
+                lines = set()
+                for item in payload.get("lines", []):
+                    line = _to_int(item.get("line", None))
+                    if line is not None:
+                        lines.add(line)
+                lines = sorted(lines)
+            cached = (stamp, lines)
+            self._lines[file] = cached
+
+        lines = cached[1]
+        if not lines:
+            return list(range(start, end + 1))
+        return lines[bisect.bisect_left(lines, start) : bisect.bisect_right(lines, end)]
+
+    def delete_breakpoints(self, numbers):
+        if len(numbers) == 0:
+            return None
+        return self._execute("-break-delete " + " ".join(str(n) for n in numbers))
 
     def clear_breakpoints(self):
-        return self._execute("clear")
+        return self._execute("-break-delete")
 
     def kill(self):
+        """
+        Kill the program, along with all checkpoints.
+        """
+        self._drop_core()
         self._running = False
+        self._checkpoint = None
+        self._current = None
         return self._execute("kill")
 
+    def reset(self):
+        """
+        Kill the program and delete all breakpoints, so that the instance can
+        be reused by another stage. Symbols are kept, and GDB reloads them on
+        the next run if the executable is rebuilt.
+        """
+        self.kill()
+        return self.clear_breakpoints()
+
     def exit(self):
         self.kill()
         self._controller.exit()
 
 
 class GdbWrapperFactory:
+    """
+    Create GDB instances, with pool_size instances started in background
+    with symbols loaded, so that one is ready when needed.
+    """
+
     def __init__(
         self,
         executable,
         args: List[str],
         env: Dict[str, str],
         cwd=os.getcwd(),
+        timeout: Dict[str, int] = None,
+        core_dir=None,
+        checkpoint=None,
+        index_dir=None,
+        pool_size=0,
     ) -> None:
         self._executable = executable
         self._args = args
         self._env = env
         self._cwd = cwd
+        self._timeout = timeout
+        self._core_dir = core_dir
+        self._checkpoint = checkpoint
+        self._index_dir = index_dir
         self._instance: GdbWrapper = None
 
+        self._pool_size = pool_size
+        self._pool = []  # futures of started instances
+        self._executor = None
+        if pool_size > 0:
+            self._executor = ThreadPoolExecutor(pool_size)
+            self._fill()
+
     def _create(self):
-        return GdbWrapper(self._executable, self._args, self._env, self._cwd)
+        return GdbWrapper(
+            self._executable,
+            self._args,
+            self._env,
+            self._cwd,
+            self._timeout,
+            self._core_dir,
+            self._checkpoint,
+            self._index_dir,
+        )
+
+    def _start(self):
+        instance = self._create()
+        instance.start()
+        return instance
+
+    def _fill(self):
+        if self._executor is None:
+            return
+        while len(self._pool) < self._pool_size:
+            self._pool.append(self._executor.submit(self._start))
+
+    def _refresh(self):
+        """
+        Replace started instances whose executable is rebuilt.
+        """
+        pool = []
+        for future in self._pool:
+            if not future.done():
+                # may have loaded the old one, checked again when taken
+                pool.append(future)
+                continue
+            if future.exception() is None and not future.result().is_stale():
+                pool.append(future)
+            elif future.exception() is None:
+                future.result().exit()
+        self._pool = pool
+        self._fill()
+
+    def _take(self):
+        while len(self._pool) > 0:
+            future = self._pool.pop(0)
+            try:
+                instance = future.result()
+            except Exception as e:
+                logger.warning(f"Failed to start GDB in background: {e}")
+                continue
+            if instance.is_stale():
+                instance.exit()
+                continue
+            return instance
+        return None
 
     def get(self):
         if self._instance is None:
-            self._instance = self._create()
-            self._instance.start()
+            instance = self._take()
+            if instance is None:
+                instance = self._start()
+            self._instance = instance
+            self._fill()
         return self._instance
 
     def respawn(self):
         if self._instance is not None:
             self._instance.exit()
         self._instance = None
+        self._refresh()
+
+    def reset(self):
+        if self._instance is not None:
+            self._instance.reset()
+
+    def close(self):
+        """
+        Exit the instance and all started ones.
+        """
+        if self._instance is not None:
+            self._instance.exit()
+        self._instance = None
+        if self._executor is None:
+            return
+        for future in self._pool:
+            future.cancel()
+        self._executor.shutdown(wait=True)
+        for future in self._pool:
+            if not future.cancelled() and future.exception() is None:
+                future.result().exit()
+        self._pool = []
+        self._executor = None
 
 
 ######################################################################
@@ -152,11 +971,41 @@ class GdbWrapperFactory:
 GDB_FACTORY = None
 
 
-def gdb_init(executable, args=[], env={}, cwd=os.getcwd()):
+def gdb_init(
+    executable,
+    args=[],
+    env={},
+    cwd=os.getcwd(),
+    timeout=None,
+    core_dir=None,
+    checkpoint=None,
+    index_dir=None,
+    pool_size=0,
+):
     global GDB_FACTORY
     if GDB_FACTORY is not None:
-        GDB_FACTORY.respawn()
-    GDB_FACTORY = GdbWrapperFactory(executable, args, env, cwd)
+        GDB_FACTORY.close()
+    GDB_FACTORY = GdbWrapperFactory(
+        executable,
+        args,
+        env,
+        cwd,
+        timeout,
+        core_dir,
+        checkpoint,
+        index_dir,
+        pool_size,
+    )
+
+
+def gdb_attach(factory: GdbWrapperFactory):
+    """
+    Use an existing factory, so that its GDB instance is kept warm when
+    switching between projects.
+    """
+    global GDB_FACTORY
+    GDB_FACTORY = factory
+    return factory
 
 
 def gdb_instance():
@@ -172,4 +1021,6 @@ def gdb_respawn():
 
 
 def gdb_exit():
-    gdb_respawn()
+    if GDB_FACTORY is None:
+        raise Exception("GDB not initialized")
+    GDB_FACTORY.close()
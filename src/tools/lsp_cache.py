@@ -0,0 +1,120 @@
+import json
+from collections import OrderedDict
+from typing import List
+
+import diskcache
+
+from tools.file_integration import file_get_hash
+
+
+class LspCache:
+    """
+    Cache of LSP query results. Entries are keyed on the query and the content
+    hash of the queried file, and record the content hash of every file the
+    result depends on, so that stale entries are never returned.
+    Memory tier is evicted in LRU order, and the optional disk tier can be
+    shared between stages.
+    """
+
+    def __init__(self, capacity=1024, directory=None) -> None:
+        self._capacity = capacity
+        self._entries = OrderedDict()  # key -> (value, dependencies)
+        self._files = {}  # filename -> set of keys
+        self._disk = None
+        if directory is not None:
+            self._disk = diskcache.Cache(directory)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, method, filename, *args):
+        return json.dumps([method, filename, file_get_hash(filename), *args])
+
+    def _is_valid(self, dependencies):
+        for filename, digest in dependencies.items():
+            if file_get_hash(filename) != digest:
+                return False
+        return True
+
+    def _remember(self, key, value, dependencies):
+        self._entries[key] = (value, dependencies)
+        self._entries.move_to_end(key)
+        for filename in dependencies:
+            self._files.setdefault(filename, set()).add(key)
+        while len(self._entries) > self._capacity:
+            self._forget(next(iter(self._entries)))
+
+    def _forget(self, key):
+        _, dependencies = self._entries.pop(key)
+        for filename in dependencies:
+            keys = self._files.get(filename, None)
+            if keys is not None:
+                keys.discard(key)
+
+    def get(self, key):
+        """
+        Get the cached value of the key, or None if not cached or stale.
+        """
+        entry = self._entries.get(key, None)
+        if entry is None and self._disk is not None:
+            entry = self._disk.get(key, None)
+            if entry is not None:
+                self._remember(key, entry[0], entry[1])
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, dependencies = entry
+        if not self._is_valid(dependencies):
+            self._forget(key)
+            if self._disk is not None:
+                self._disk.delete(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, files: List[str]):
+        """
+        Cache the value of the key, which depends on the content of files.
+        """
+        dependencies = {filename: file_get_hash(filename) for filename in files}
+        self._remember(key, value, dependencies)
+        if self._disk is not None:
+            self._disk.set(key, (value, dependencies), tag=files[0])
+
+    def invalidate(self, filename):
+        """
+        Drop all entries that depend on the given file.
+        """
+        for key in list(self._files.pop(filename, set())):
+            if key in self._entries:
+                self._forget(key)
+        if self._disk is not None:
+            self._disk.evict(filename)
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
+
+
+######################################################################
+# LSP cache instance management
+
+LSP_CACHE = LspCache()
+
+
+def lsp_cache_init(directory=None, capacity=1024):
+    global LSP_CACHE
+    LSP_CACHE.close()
+    LSP_CACHE = LspCache(capacity, directory)
+    return LSP_CACHE
+
+
+def lsp_cache_instance():
+    return LSP_CACHE
+
+
+def lsp_cache_invalidate(filename):
+    LSP_CACHE.invalidate(filename)
@@ -1,6 +1,25 @@
 import json
+import logging
 import os
 import subprocess
+import threading
+import time
+from concurrent.futures import Future
+
+# progress token of clangd background indexing
+INDEX_PROGRESS_TOKEN = "backgroundIndexProgress"
+# seconds to wait for diagnostics after a document is changed
+DIAGNOSTICS_TIMEOUT = 10
+# seconds to wait for the response to a request
+REQUEST_TIMEOUT = 60
+
+logger = logging.getLogger(__name__)
+
+
+def _to_lsp_message(message):
+    content = json.dumps(message).encode("utf-8")
+    header = f"Content-Length: {len(content)}\r\n\r\n".encode("utf-8")
+    return header + content
 
 
 def _to_lsp_request(id, method, params):
@@ -8,10 +27,7 @@ def _to_lsp_request(id, method, params):
     if params:
         request["params"] = params
 
-    content = json.dumps(request)
-    header = f"Content-Length: {len(content)}\r\n\r\n"
-
-    return (header + content).encode("utf-8")
+    return _to_lsp_message(request)
 
 
 def _to_lsp_notification(method, params):
@@ -19,25 +35,45 @@ def _to_lsp_notification(method, params):
     if params:
         request["params"] = params
 
-    content = json.dumps(request)
-    header = f"Content-Length: {len(content)}\r\n\r\n"
-    return (header + content).encode("utf-8")
+    return _to_lsp_message(request)
+
 
+def _to_lsp_result(id, result):
+    return _to_lsp_message({"jsonrpc": "2.0", "id": id, "result": result})
 
-def _parse_lsp_response(id, file):
-    while True:
-        header = {}
+
+class LspStreamParser:
+    """
+    Incremental parser of the Content-Length framed messages of LSP.
+    Bytes are fed as they arrive, and complete messages are returned.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._length = None
+
+    def feed(self, data):
+        self._buffer += data
+        messages = []
         while True:
-            line = file.readline().decode("utf-8").strip()
-            if not line:
+            if self._length is None:
+                end = self._buffer.find(b"\r\n\r\n")
+                if end == -1:
+                    break
+                for line in bytes(self._buffer[:end]).split(b"\r\n"):
+                    key, value = line.split(b":", 1)
+                    if key.strip().lower() == b"content-length":
+                        self._length = int(value.strip())
+                del self._buffer[: end + 4]
+                if self._length is None:
+                    raise ValueError("LSP message without Content-Length")
+            if len(self._buffer) < self._length:
                 break
-            key, value = line.split(":", 1)
-            header[key.strip()] = value.strip()
-
-        content = file.read(int(header["Content-Length"])).decode("utf-8")
-        response = json.loads(content)
-        if "id" in response and response["id"] == id:
-            return response
+            content = bytes(self._buffer[: self._length])
+            del self._buffer[: self._length]
+            self._length = None
+            messages.append(json.loads(content))
+        return messages
 
 
 def path_to_uri(path):
@@ -61,90 +97,188 @@ def is_lsp_available(executable="clangd"):
 
 
 class LspController:
+    """
+    JSON-RPC client of the language server. A reader thread dispatches
+    responses to the futures of pending requests, so that several requests
+    can be in flight at the same time, and notifications to subscribers.
+    """
+
     def __init__(
         self,
         executable="clangd",
         cwd=os.getcwd(),
         stderr=subprocess.DEVNULL,
+        args=[],
     ) -> None:
         self.id = 0
         self.cwd = cwd
         self._process = subprocess.Popen(
-            [executable],
+            [executable] + args,
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
             stderr=stderr,
             cwd=cwd,
         )
+
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._pending = {}  # id -> Future
+        self._closed = False  # set when the language server exits
+        self._subscribers = {}  # method -> [callback]
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
         self.initialize()
+        self.initialized()
+
+    def _read_loop(self):
+        parser = LspStreamParser()
+        fd = self._process.stdout.fileno()
+        try:
+            while True:
+                try:
+                    data = os.read(fd, 65536)
+                except OSError:
+                    break
+                if not data:
+                    break
+                for message in parser.feed(data):
+                    self._dispatch(message)
+        except Exception as e:
+            logger.error(f"Failed to read from language server: {e}")
+        finally:
+            # language server exited, fail all pending requests
+            with self._lock:
+                self._closed = True
+                pending = list(self._pending.values())
+                self._pending.clear()
+            for future in pending:
+                future.set_exception(ConnectionError("Language server exited"))
+
+    def _dispatch(self, message):
+        method = message.get("method", None)
+        if method is None:
+            # response to our request
+            with self._lock:
+                future = self._pending.pop(message.get("id", None), None)
+            if future is not None:
+                future.set_result(message)
+            return
+
+        if "id" in message:
+            # request from the server, e.g. window/workDoneProgress/create
+            self._write(_to_lsp_result(message["id"], None))
+        for callback in self._subscribers.get(method, []):
+            # an error in a callback must not stop the reader thread
+            try:
+                callback(message.get("params", None))
+            except Exception as e:
+                logger.error(f"Failed to handle {method}: {e}")
+
+    def _write(self, data):
+        with self._write_lock:
+            self._process.stdin.write(data)
+            self._process.stdin.flush()
+
+    def subscribe(self, method, callback):
+        """
+        Subscribe to notifications (or requests) of the given method from the
+        language server. The callback is invoked with the params in the reader
+        thread, so it should return quickly.
+        """
+        self._subscribers.setdefault(method, []).append(callback)
+
+    def request(self, method, params) -> Future:
+        """
+        Send a request without waiting for the response.
+        Returns a future of the response.
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                future.set_exception(ConnectionError("Language server exited"))
+                return future
+            self.id += 1
+            id = self.id
+            self._pending[id] = future
+        self._write(_to_lsp_request(id, method, params))
+        return future
+
+    def notify(self, method, params):
+        self._write(_to_lsp_notification(method, params))
 
     def initialize(self):
-        self.id += 1
-        request = _to_lsp_request(
-            self.id,
+        return self.request(
             "initialize",
             {
                 "processId": os.getpid(),
                 "rootUri": path_to_uri(self.cwd),
+                "capabilities": {
+                    # required for clangd to report indexing progress
+                    "window": {"workDoneProgress": True},
+                    # so that diagnostics can be matched to document versions
+                    "textDocument": {"publishDiagnostics": {"versionSupport": True}},
+                },
             },
-        )
-        self._process.stdin.write(request)
-        self._process.stdin.flush()
-        return _parse_lsp_response(self.id, self._process.stdout)
+        ).result(REQUEST_TIMEOUT)
 
     def initialized(self):
-        notification = _to_lsp_notification("initialized", {})
-        self._process.stdin.write(notification)
-        self._process.stdin.flush()
+        self.notify("initialized", {})
 
         return None
 
-    def didOpen(self, filename):
+    def didOpen(self, filename, text=None, version=1):
         """
         Open a file in the language server.
         """
         _, ext = os.path.splitext(filename)
         languageId = "c" if ext == ".c" else "cpp"
 
-        with open(filename, "r") as file:
-            text = file.read()
+        if text is None:
+            with open(filename, "r") as file:
+                text = file.read()
 
-        notification = _to_lsp_notification(
+        self.notify(
             "textDocument/didOpen",
             {
                 "textDocument": {
                     "uri": path_to_uri(filename),
                     "languageId": languageId,
+                    "version": version,
                     "text": text,
                 }
             },
         )
-        self._process.stdin.write(notification)
-        self._process.stdin.flush()
 
         # notification has no response
         return None
 
+    def didChange(self, filename, version, changes):
+        """
+        Notify the language server of changes to an opened file.
+        Each change is either {"text": <full text>}, or a ranged change with
+        {"range": <range>, "text": <new text>} for incremental update.
+        """
+        self.notify(
+            "textDocument/didChange",
+            {
+                "textDocument": {"uri": path_to_uri(filename), "version": version},
+                "contentChanges": changes,
+            },
+        )
+
     def didClose(self, filename):
         """
         Close a file in the language server.
         Should use this and didOpen in pair.
         """
-        notification = _to_lsp_notification(
+        self.notify(
             "textDocument/didClose",
             {"textDocument": {"uri": path_to_uri(filename)}},
         )
-        self._process.stdin.write(notification)
-        self._process.stdin.flush()
 
-    def definition(self, filename, line, character):
-        """
-        Get the definition of a symbol at a given position.
-        Must call didOpen on the file before calling this method.
-        """
-        self.id += 1
-        request = _to_lsp_request(
-            self.id,
+    def definition_async(self, filename, line, character) -> Future:
+        return self.request(
             "textDocument/definition",
             {
                 "textDocument": {"uri": path_to_uri(filename)},
@@ -154,17 +288,17 @@ class LspController:
                 },
             },
         )
-        self._process.stdin.write(request)
-        self._process.stdin.flush()
-        return _parse_lsp_response(self.id, self._process.stdout)
 
-    def hover(self, filename, line, character):
+    def definition(self, filename, line, character):
         """
-        Get the hover information at a given position.
+        Get the definition of a symbol at a given position.
+        Must call didOpen on the file before calling this method.
         """
-        self.id += 1
-        request = _to_lsp_request(
-            self.id,
+        future = self.definition_async(filename, line, character)
+        return future.result(REQUEST_TIMEOUT)
+
+    def hover_async(self, filename, line, character) -> Future:
+        return self.request(
             "textDocument/hover",
             {
                 "textDocument": {"uri": path_to_uri(filename)},
@@ -174,60 +308,198 @@ class LspController:
                 },
             },
         )
-        self._process.stdin.write(request)
-        self._process.stdin.flush()
-        return _parse_lsp_response(self.id, self._process.stdout)
 
-    def documentSymbol(self, filename):
+    def hover(self, filename, line, character):
         """
-        Get all symbols in the document. It only get top-level symbols such as
-        functions and classes.
+        Get the hover information at a given position.
         """
-        self.id += 1
-        request = _to_lsp_request(
-            self.id,
+        future = self.hover_async(filename, line, character)
+        return future.result(REQUEST_TIMEOUT)
+
+    def documentSymbol_async(self, filename) -> Future:
+        return self.request(
             "textDocument/documentSymbol",
             {"textDocument": {"uri": path_to_uri(filename)}},
         )
-        self._process.stdin.write(request)
-        self._process.stdin.flush()
-        return _parse_lsp_response(self.id, self._process.stdout)
+
+    def documentSymbol(self, filename):
+        """
+        Get all symbols in the document. It only get top-level symbols such as
+        functions and classes.
+        """
+        return self.documentSymbol_async(filename).result(REQUEST_TIMEOUT)
 
     def exit(self):
         self._process.terminate()
 
 
+def _file_stamp(filename):
+    stat = os.stat(filename)
+    return stat.st_mtime_ns, stat.st_size
+
+
 class LspWrapper:
-    def __init__(self, executable="clangd", cwd=os.getcwd()):
+    def __init__(self, executable="clangd", cwd=os.getcwd(), index_timeout=None):
+        """
+        If index_timeout is given, the first query will wait for the background
+        index to be ready for at most index_timeout seconds.
+        """
         if not is_lsp_available(executable):
             raise FileNotFoundError(f"{executable} is not available")
-        self._controller = LspController(executable, cwd)
+        self._controller = LspController(executable, cwd, args=["--background-index"])
         self._cwd = cwd
 
+        # opened documents, filename -> {"version", "stamp"}
+        self._documents = {}
+
+        self._indexing = threading.Event()
+        self._indexed = threading.Event()
+        self._controller.subscribe("$/progress", self._on_progress)
+        self._index_timeout = index_timeout
+        self.index_time = None
+
+        # filename -> (version, diagnostics), the latest published ones
+        self._diagnostics = {}
+        self._diagnostics_published = threading.Condition()
+        self._controller.subscribe(
+            "textDocument/publishDiagnostics", self._on_diagnostics
+        )
+
+    def _on_progress(self, params):
+        if params is None or params.get("token", None) != INDEX_PROGRESS_TOKEN:
+            return
+        kind = params["value"]["kind"]
+        if kind == "begin":
+            self._indexed.clear()
+            self._indexing.set()
+        elif kind == "end":
+            self._indexed.set()
+
+    def _on_diagnostics(self, params):
+        filename = uri_to_path(params["uri"])
+        with self._diagnostics_published:
+            self._diagnostics[filename] = (
+                params.get("version", None),
+                params["diagnostics"],
+            )
+            self._diagnostics_published.notify_all()
+
+    def wait_ready(self, timeout, grace=2):
+        """
+        Wait for the background index to finish. Indexing only starts after
+        the first file is opened, and if it does not start within grace seconds,
+        the index is considered up-to-date. Returns seconds waited.
+        """
+        start = time.time()
+        if self._indexing.wait(grace):
+            self._indexed.wait(max(0, timeout - (time.time() - start)))
+        return time.time() - start
+
+    def _open(self, filename):
+        """
+        Make sure the file is opened in the language server and in sync with
+        the file on disk. Opened files are kept open, so that clangd can reuse
+        the parsed translation unit across queries.
+        """
+        stamp = _file_stamp(filename)
+        document = self._documents.get(filename, None)
+        if document is None:
+            self._controller.didOpen(filename)
+            self._documents[filename] = {"version": 1, "stamp": stamp}
+            if self._index_timeout is not None and self.index_time is None:
+                self.index_time = self.wait_ready(self._index_timeout)
+            return
+        if document["stamp"] == stamp:
+            return
+
+        # modified outside the editor, send full content
+        with open(filename, "r") as file:
+            text = file.read()
+        document["version"] += 1
+        document["stamp"] = stamp
+        self._controller.didChange(filename, document["version"], [{"text": text}])
+
+    def change(self, filename, start_line, end_line, text):
+        """
+        Replace lines from start_line to end_line (inclusive) of an opened
+        document with text, which should end with a new line if not empty.
+        To insert text after line, use start_line = line + 1, end_line = line.
+        It should be called after the file is modified on disk.
+        """
+        document = self._documents.get(filename, None)
+        if document is None:
+            # not opened yet, will be synced on next query
+            return
+        document["version"] += 1
+        document["stamp"] = _file_stamp(filename)
+        change = {
+            "range": {
+                "start": {"line": start_line - 1, "character": 0},
+                "end": {"line": end_line, "character": 0},
+            },
+            "text": text,
+        }
+        self._controller.didChange(filename, document["version"], [change])
+
+    def reload(self, filename):
+        """
+        Sync the whole content of an opened document with the file on disk.
+        """
+        document = self._documents.get(filename, None)
+        if document is None:
+            return
+        # force full sync on next query
+        document["stamp"] = None
+        self._open(filename)
+
+    def close(self, filename):
+        if self._documents.pop(filename, None) is not None:
+            self._controller.didClose(filename)
+        with self._diagnostics_published:
+            self._diagnostics.pop(filename, None)
+
+    def diagnostics(self, filename, timeout=DIAGNOSTICS_TIMEOUT):
+        """
+        Get diagnostics of the current content of a document, which are
+        published once the language server has parsed it. Return None if
+        they are not published within timeout seconds.
+        """
+        self._open(filename)
+        version = self._documents[filename]["version"]
+
+        def _published():
+            entry = self._diagnostics.get(filename, None)
+            # without version, they are of the latest content sent
+            return entry is not None and (entry[0] is None or entry[0] >= version)
+
+        with self._diagnostics_published:
+            if not self._diagnostics_published.wait_for(_published, timeout):
+                return None
+            return self._diagnostics[filename][1]
+
     def definition(self, filename, line, character):
-        self._controller.didOpen(filename)
+        self._open(filename)
         response = self._controller.definition(filename, line, character)
-        self._controller.didClose(filename)
 
         if len(response["result"]) == 0:
             return None
         return response["result"][0]
 
     def summary(self, filename, line, character):
-        self._controller.didOpen(filename)
+        self._open(filename)
         response = self._controller.hover(filename, line, character)
-        self._controller.didClose(filename)
 
         return response["result"]
 
     def document_symbol(self, filename):
-        self._controller.didOpen(filename)
+        self._open(filename)
         response = self._controller.documentSymbol(filename)
-        self._controller.didClose(filename)
 
         return response["result"]
 
     def exit(self):
+        for filename in list(self._documents.keys()):
+            self.close(filename)
         self._controller.exit()
 
     def to_abs_path(self, filename):
@@ -242,13 +514,16 @@ class LspWrapper:
 
 
 class LspWrapperFactory:
-    def __init__(self, executable="clangd", cwd=os.getcwd()) -> None:
+    def __init__(
+        self, executable="clangd", cwd=os.getcwd(), index_timeout=None
+    ) -> None:
         self._executable = executable
         self._cwd = cwd
+        self._index_timeout = index_timeout
         self._instance: LspWrapper = None
 
     def _create(self):
-        return LspWrapper(self._executable, self._cwd)
+        return LspWrapper(self._executable, self._cwd, self._index_timeout)
 
     def get(self):
         if self._instance is None:
@@ -260,20 +535,33 @@ class LspWrapperFactory:
             self._instance.exit()
         self._instance = None
 
+    def is_alive(self):
+        return self._instance is not None
+
 
 ######################################################################
 # LSP instance management
 LSP_FACTORY = None
 
 
-def lsp_init(executable="clangd", cwd=os.getcwd()):
+def lsp_init(executable="clangd", cwd=os.getcwd(), index_timeout=None):
     global LSP_FACTORY
     if LSP_FACTORY is not None:
         LSP_FACTORY.respawn()
-    LSP_FACTORY = LspWrapperFactory(executable, cwd)
+    LSP_FACTORY = LspWrapperFactory(executable, cwd, index_timeout)
     return LSP_FACTORY
 
 
+def lsp_attach(factory: LspWrapperFactory):
+    """
+    Use an existing factory, so that its language server is kept warm when
+    switching between projects.
+    """
+    global LSP_FACTORY
+    LSP_FACTORY = factory
+    return factory
+
+
 def lsp_instance():
     if LSP_FACTORY is not None:
         return LSP_FACTORY.get()
@@ -290,6 +578,47 @@ def lsp_exit():
     lsp_respawn()
 
 
+def lsp_index_time():
+    """
+    Seconds the first query waited for the background index, or None if
+    the language server is not running or has not waited yet.
+    """
+    if LSP_FACTORY is None or not LSP_FACTORY.is_alive():
+        return None
+    return LSP_FACTORY.get().index_time
+
+
 def lsp_to_abs_path(filename):
     lsp = lsp_instance()
     return lsp.to_abs_path(filename), lsp.get_cwd()
+
+
+def lsp_did_change(filename, start_line, end_line, text):
+    """
+    Notify the running language server that lines from start_line to end_line
+    (inclusive) of filename were replaced by text. Will not start the language
+    server if it is not running.
+    """
+    if LSP_FACTORY is None or not LSP_FACTORY.is_alive():
+        return
+    LSP_FACTORY.get().change(filename, start_line, end_line, text)
+
+
+def lsp_diagnostics(filename):
+    """
+    Get diagnostics of filename from the running language server, or None if
+    it is not running or they are not published in time. Will not start the
+    language server, as parsing from a cold start is slower than building.
+    """
+    if LSP_FACTORY is None or not LSP_FACTORY.is_alive():
+        return None
+    return LSP_FACTORY.get().diagnostics(filename)
+
+
+def lsp_did_reload(filename):
+    """
+    Notify the running language server that filename was rewritten.
+    """
+    if LSP_FACTORY is None or not LSP_FACTORY.is_alive():
+        return
+    LSP_FACTORY.get().reload(filename)
@@ -0,0 +1,305 @@
+import bisect
+import difflib
+import os
+import re
+import shutil
+import tempfile
+from array import array
+
+
+def _index_lines(text):
+    # offsets of "\n" in text
+    return array("Q", (m.start() for m in re.finditer("\n", text)))
+
+
+class PieceTable:
+    """
+    Text of a file as pieces of the original text and of the texts added by
+    edits, so that an edit does not copy the whole text. Line breaks of each
+    buffer are indexed, so that lines are located by walking the pieces only.
+    """
+
+    def __init__(self, text) -> None:
+        self._buffers = [text]
+        self._newlines = [_index_lines(text)]
+        self._pieces = []  # [(buffer, start, end)]
+        if len(text) > 0:
+            self._pieces.append((0, 0, len(text)))
+        self._length = len(text)
+
+    def copy(self):
+        """
+        Copy the table, buffers are shared as they are never modified.
+        """
+        table = PieceTable.__new__(PieceTable)
+        table._buffers = list(self._buffers)
+        table._newlines = list(self._newlines)
+        table._pieces = list(self._pieces)
+        table._length = self._length
+        return table
+
+    def __len__(self):
+        return self._length
+
+    def _count_newlines(self, piece):
+        buffer, start, end = piece
+        newlines = self._newlines[buffer]
+        return bisect.bisect_left(newlines, end) - bisect.bisect_left(newlines, start)
+
+    def line_offset(self, line):
+        """
+        Get the offset of the start of line (1-based), or the length of the
+        text if the text has fewer lines.
+        """
+        remaining = line - 1
+        offset = 0
+        if remaining <= 0:
+            return 0
+        for piece in self._pieces:
+            count = self._count_newlines(piece)
+            buffer, start, end = piece
+            if count >= remaining:
+                newlines = self._newlines[buffer]
+                index = bisect.bisect_left(newlines, start) + remaining - 1
+                return offset + newlines[index] + 1 - start
+            remaining -= count
+            offset += end - start
+        return self._length
+
+    def _split(self, offset):
+        """
+        Split pieces at offset, return the index of the first piece at or
+        after offset.
+        """
+        position = 0
+        for index, (buffer, start, end) in enumerate(self._pieces):
+            if position == offset:
+                return index
+            if position + end - start > offset:
+                middle = start + offset - position
+                self._pieces[index : index + 1] = [
+                    (buffer, start, middle),
+                    (buffer, middle, end),
+                ]
+                return index + 1
+            position += end - start
+        return len(self._pieces)
+
+    def replace(self, start, end, text):
+        """
+        Replace the text from offset start to end (exclusive) with text,
+        return the replaced text.
+        """
+        first = self._split(start)
+        last = self._split(end)
+        removed = self._pieces[first:last]
+        old = "".join(self._buffers[b][s:e] for b, s, e in removed)
+        added = []
+        if len(text) > 0:
+            self._buffers.append(text)
+            self._newlines.append(_index_lines(text))
+            added.append((len(self._buffers) - 1, 0, len(text)))
+        self._pieces[first:last] = added
+        self._length += len(text) - len(old)
+        return old
+
+    def get_text(self, start=0, end=None):
+        if end is None:
+            end = self._length
+        chunks = []
+        position = 0
+        for buffer, s, e in self._pieces:
+            length = e - s
+            if position + length > start and position < end:
+                lo = s + max(0, start - position)
+                hi = s + min(length, end - position)
+                chunks.append(self._buffers[buffer][lo:hi])
+            position += length
+            if position >= end:
+                break
+        return "".join(chunks)
+
+
+def _get_stamp(filename):
+    stat = os.stat(filename)
+    return stat.st_mtime_ns, stat.st_size
+
+
+class PatchEngine:
+    """
+    Files being edited, held as piece tables. Hunks of several files are
+    applied in one transaction and written through temporary files renamed
+    over the originals. Each edit is recorded as a reverse delta of
+    (offset, length, old text), so that files are restored to the content
+    they had when marked, without keeping copies of them unless they are
+    modified outside the engine.
+    """
+
+    def __init__(self) -> None:
+        self._tables = {}  # filename -> (stamp, PieceTable)
+        self._deltas = {}  # filename -> [reverse delta] since the mark
+
+    def _load(self, filename):
+        """
+        Get the table of a file. If the file is modified outside the engine,
+        it is loaded again, and the reverse deltas of a marked file are
+        replaced with a copy of its marked content, which no longer matches
+        the offsets of the new content.
+        """
+        stamp = _get_stamp(filename)
+        entry = self._tables.get(filename, None)
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+        with open(filename, "r") as f:
+            table = PieceTable(f.read())
+        self._tables[filename] = (stamp, table)
+        if entry is not None and filename in self._deltas:
+            marked = entry[1].copy()
+            for start, length, old in reversed(self._deltas[filename]):
+                marked.replace(start, start + length, old)
+            self._deltas[filename] = [(0, len(table), marked.get_text())]
+        return table
+
+    def mark(self, filename):
+        """
+        Mark the current content of a file to be restored by restore().
+        """
+        self._deltas.pop(filename, None)
+        self._load(filename)
+        self._deltas[filename] = []
+
+    def is_marked(self, filename):
+        return filename in self._deltas
+
+    def _write(self, tables):
+        """
+        Write tables as filename -> PieceTable, all files are written to
+        temporary files before any of them is renamed.
+        """
+        temps = []
+        try:
+            for filename, table in tables.items():
+                fd, temp = tempfile.mkstemp(
+                    dir=os.path.dirname(filename),
+                    prefix=os.path.basename(filename) + ".",
+                    suffix=".tmp",
+                )
+                temps.append((temp, filename))
+                with open(fd, "w") as f:
+                    f.write(table.get_text())
+                shutil.copymode(filename, temp)
+        except BaseException:
+            for temp, _ in temps:
+                os.remove(temp)
+            raise
+        for temp, filename in temps:
+            os.replace(temp, filename)
+            self._tables[filename] = (_get_stamp(filename), tables[filename])
+
+    def apply(self, hunks):
+        """
+        Apply hunks as a transaction, each hunk is (filename, start_line,
+        end_line, text), replacing lines from start_line to end_line
+        (inclusive) with text, or inserting text before start_line if
+        end_line is start_line - 1. Line numbers refer to the files before
+        the transaction, and hunks of the same file must not overlap.
+        Return the applied hunks of each file, as filename -> [(start_line,
+        end_line, text, at_end)] from the bottom of the file up, where at_end
+        means the hunk reaches the end of the file.
+        """
+        by_file = {}
+        for filename, start_line, end_line, text in hunks:
+            if start_line < 1 or end_line < start_line - 1:
+                raise ValueError(f"Invalid range {start_line}-{end_line}")
+            by_file.setdefault(filename, []).append((start_line, end_line, text))
+
+        tables = {}
+        deltas = {}
+        applied = {}
+        for filename, file_hunks in by_file.items():
+            # from the bottom up, so that line numbers of the others are kept
+            file_hunks.sort(key=lambda hunk: (hunk[0], hunk[1]), reverse=True)
+            for lower, upper in zip(file_hunks[1:], file_hunks):
+                # two insertions at the same line have no order
+                if lower[1] >= upper[0] or lower[:2] == upper[:2]:
+                    raise ValueError(
+                        f"Overlapping hunks at line {upper[0]} of {filename}"
+                    )
+            table = self._load(filename).copy()
+            tables[filename] = table
+            deltas[filename] = []
+            applied[filename] = []
+            for start_line, end_line, text in file_hunks:
+                start = table.line_offset(start_line)
+                end = table.line_offset(end_line + 1)
+                at_end = end == len(table)
+                if at_end and start > 0 and table.get_text(start - 1, start) != "\n":
+                    # keep the last line of the file on its own
+                    text = "\n" + text
+                old = table.replace(start, end, text)
+                deltas[filename].append((start, len(text), old))
+                applied[filename].append((start_line, end_line, text, at_end))
+
+        self._write(tables)
+        for filename, file_deltas in deltas.items():
+            if filename in self._deltas:
+                self._deltas[filename].extend(file_deltas)
+        return applied
+
+    def restore(self, filename):
+        """
+        Restore a file to its marked content by applying its reverse deltas.
+        """
+        if filename not in self._deltas:
+            raise FileNotFoundError(f"File {filename} not marked.")
+        table = self._load(filename)
+        deltas = self._deltas[filename]
+        if len(deltas) == 0:
+            return
+        table = table.copy()
+        for start, length, old in reversed(deltas):
+            table.replace(start, start + length, old)
+        self._write({filename: table})
+        self._deltas[filename] = []
+
+    def _get_marked_text(self, filename):
+        table = self._load(filename).copy()
+        for start, length, old in reversed(self._deltas[filename]):
+            table.replace(start, start + length, old)
+        return table.get_text()
+
+    def diff(self, root=None):
+        """
+        Get the unified diff of all marked files from their marked content,
+        with paths relative to root if given.
+        """
+        chunks = []
+        for filename in sorted(self._deltas):
+            if len(self._deltas[filename]) == 0 or not os.path.exists(filename):
+                continue
+            old = self._get_marked_text(filename)
+            new = self._load(filename).get_text()
+            if old == new:
+                continue
+            name = filename if root is None else os.path.relpath(filename, root)
+            for line in difflib.unified_diff(
+                old.splitlines(keepends=True),
+                new.splitlines(keepends=True),
+                fromfile=f"a/{name}",
+                tofile=f"b/{name}",
+            ):
+                chunks.append(line)
+                if not line.endswith("\n"):
+                    # last line of a file without a line break
+                    chunks.append("\n\\ No newline at end of file\n")
+        return "".join(chunks)
+
+
+######################################################################
+# Patch engine instance management
+
+PATCH_ENGINE = PatchEngine()
+
+
+def patch_engine_instance():
+    return PATCH_ENGINE
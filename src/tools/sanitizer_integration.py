@@ -0,0 +1,299 @@
+import re
+
+# header of ASan, MSan, LSan and TSan reports, e.g.
+# ==1==ERROR: AddressSanitizer: heap-buffer-overflow on address 0x602000000014 ...
+# WARNING: ThreadSanitizer: data race (pid=1)
+_HEADER = re.compile(r"^(?:==\d+==\s*)?(?:ERROR|WARNING): (\w+Sanitizer):\s*(.*)$")
+# error type in the header, before the address or pid
+_ERROR_END = re.compile(r"\s+(?:on (?:unknown )?address|at pc|\(pid=|\(tid=)")
+# UBSan error, e.g. a.c:3:5: runtime error: signed integer overflow ...
+_RUNTIME_ERROR = re.compile(r"^(.+?):(\d+):(?:(\d+):)?\s+runtime error:\s+(.*)$")
+# stack frame of all sanitizers, TSan does not print the address, e.g.
+#     #0 0x4f2a3b in main /src/a.c:3:5
+#     #1 0x7f0e1c in __libc_start_main (/lib/libc.so.6+0x2409b)
+#     #0 foo /src/a.c:3:5 (a.out+0x4f2a3b)
+_FRAME = re.compile(r"^\s*#(\d+)\s+(?:(0x[0-9a-fA-F]+)\s+)?(?:in\s+)?(.*)$")
+_FRAME_MODULE = re.compile(r"\s*\(([^()\s]+)\+0x[0-9a-fA-F]+\)$")
+_FRAME_LOCATION = re.compile(r"(?:^|\s+)(\S+?):(\d+)(?::(\d+))?$")
+# memory access of ASan and TSan, e.g.
+# READ of size 4 at 0x602000000014 thread T0
+# Previous write of size 4 at 0x7b0400000000 by main thread:
+_ACCESS = re.compile(
+    r"^\s*((?:previous |atomic )*(?:read|write))(?: \([^)]*\))? of size (\d+)"
+    r" at (0x[0-9a-fA-F]+)(?:.*?\b(?:by )?(main thread|thread T\d+))?",
+    re.IGNORECASE,
+)
+# memory access of ASan on SEGV
+_SIGNAL_ACCESS = re.compile(r"The signal is caused by a (\w+) memory access")
+# leak of LSan, e.g. Direct leak of 8 byte(s) in 1 object(s) allocated from:
+_LEAK = re.compile(r"^(Direct|Indirect) leak of (\d+) byte\(s\) in (\d+) object")
+_FREE = re.compile(r"\bfreed by\b")
+_ALLOCATION = re.compile(
+    r"\ballocated by\b|\bcreated by an? (?:heap |stack )?allocation\b|^\s*Location is"
+)
+_SUMMARY = "SUMMARY:"
+_UBSAN = "UndefinedBehaviorSanitizer"
+_LSAN = "LeakSanitizer"
+
+
+def _parse_frame(line):
+    """
+    Parse a stack frame as a dict of level, addr, func, file, line, column
+    and module, or None if it is not a frame. Missing fields are None.
+    """
+    m = _FRAME.match(line)
+    if m is None:
+        return None
+    frame = {
+        "level": int(m.group(1)),
+        "addr": m.group(2),
+        "func": None,
+        "file": None,
+        "line": None,
+        "column": None,
+        "module": None,
+    }
+    rest = m.group(3).strip()
+    module = _FRAME_MODULE.search(rest)
+    if module is not None:
+        frame["module"] = module.group(1)
+        rest = rest[: module.start()]
+    location = _FRAME_LOCATION.search(rest)
+    if location is not None:
+        frame["file"] = location.group(1)
+        frame["line"] = int(location.group(2))
+        if location.group(3) is not None:
+            frame["column"] = int(location.group(3))
+        rest = rest[: location.start()]
+    frame["func"] = rest.strip() or None
+    return frame
+
+
+class SanitizerReport:
+    """
+    Report of a sanitizer error. Kind is the sanitizer, e.g. AddressSanitizer,
+    and error is the type of the error, e.g. heap-buffer-overflow. Access is a
+    dict of type, size, address and thread if known, and the line it is parsed
+    from. Frames, allocation and free are stacks of frames, and other stacks of
+    the report, e.g. previous accesses of TSan, are kept in related as (title,
+    frames).
+    """
+
+    def __init__(self, kind, error, header) -> None:
+        self.kind = kind
+        self.error = error
+        self.header = header
+        self.description = []  # lines between the header and the first stack
+        self.access = None
+        self.frames = []
+        self.allocation = []
+        self.free = []
+        self.related = []  # [(title, frames)]
+        self.summary = None
+        # location of UBSan errors, which may have no stack
+        self.filename = None
+        self.line = None
+
+    def location(self, func=None):
+        """
+        Get (filename, line) of the first frame with a source location, or
+        of the first such frame whose function contains func if given.
+        """
+        first = None
+        for frame in self.frames:
+            if frame["file"] is None or frame["line"] is None:
+                continue
+            if func is None or (frame["func"] is not None and func in frame["func"]):
+                return frame["file"], frame["line"]
+            if first is None:
+                first = (frame["file"], frame["line"])
+        if first is not None:
+            return first
+        return self.filename, self.line
+
+
+class SanitizerParser:
+    """
+    Incremental parser of sanitizer output. Output is fed as it arrives, and
+    each line is matched once, so that large outputs are parsed in linear
+    time. Lines outside reports are dropped.
+    """
+
+    def __init__(self) -> None:
+        self._buffer = bytearray()
+        self._report = None
+        self._stack = None  # frames of the current section
+        self._pending = None  # title of a section whose frames are not seen yet
+
+    def feed(self, data):
+        """
+        Feed bytes or text, return reports completed by it.
+        """
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        start = len(self._buffer)
+        self._buffer += data
+        end = self._buffer.rfind(b"\n", start)
+        if end == -1:
+            return []
+        lines = bytes(self._buffer[:end]).decode("utf-8", errors="replace")
+        del self._buffer[: end + 1]
+        reports = []
+        for line in lines.split("\n"):
+            report = self._parse_line(line.rstrip("\r"))
+            if report is not None:
+                reports.append(report)
+        return reports
+
+    def close(self):
+        """
+        Finish parsing, return the remaining reports, e.g. UBSan errors
+        without SUMMARY.
+        """
+        reports = []
+        if len(self._buffer) > 0:
+            line = bytes(self._buffer).decode("utf-8", errors="replace")
+            self._buffer = bytearray()
+            report = self._parse_line(line.rstrip("\r"))
+            if report is not None:
+                reports.append(report)
+        report = self._finish()
+        if report is not None:
+            reports.append(report)
+        return reports
+
+    def _finish(self):
+        report = self._report
+        self._report = None
+        self._stack = None
+        self._pending = None
+        return report
+
+    def _start(self, report):
+        previous = self._finish()
+        self._report = report
+        return previous
+
+    def _parse_line(self, line):
+        """
+        Parse a line, return the report completed by it, if any.
+        """
+        report = self._report
+        if report is not None and "#" in line:
+            frame = _parse_frame(line)
+            if frame is not None:
+                self._add_frame(frame)
+                return None
+
+        if _SUMMARY in line:
+            if report is None or not line.startswith(_SUMMARY):
+                return None
+            report.summary = line
+            return self._finish()
+
+        m = _HEADER.match(line)
+        if m is not None:
+            kind, rest = m.group(1), m.group(2)
+            error = _ERROR_END.split(rest, 1)[0].strip()
+            return self._start(SanitizerReport(kind, error, line.strip()))
+
+        if "runtime error:" in line:
+            m = _RUNTIME_ERROR.match(line)
+            if m is not None:
+                new = SanitizerReport(_UBSAN, m.group(4).strip(), line.strip())
+                new.filename = m.group(1)
+                new.line = int(m.group(2))
+                return self._start(new)
+
+        if report is None:
+            return None
+        if line.strip() == "":
+            self._stack = None
+            self._pending = None
+            return None
+        self._parse_title(report, line)
+        return None
+
+    def _parse_title(self, report, line):
+        """
+        Parse a line of the report which is not a frame, which may be the
+        title of the next stack.
+        """
+        title = line.strip()
+        if report.kind == _LSAN:
+            m = _LEAK.match(title)
+            if m is not None:
+                if report.access is None:
+                    report.access = {
+                        "type": m.group(1).lower() + " leak",
+                        "size": int(m.group(2)),
+                        "address": None,
+                        "thread": None,
+                        "line": title,
+                    }
+                    self._stack = report.frames
+                else:
+                    self._stack = None
+                    self._pending = title
+                return
+
+        m = _ACCESS.match(title)
+        if m is not None:
+            if report.access is None:
+                report.access = {
+                    "type": m.group(1).upper(),
+                    "size": int(m.group(2)),
+                    "address": m.group(3),
+                    "thread": m.group(4),
+                    "line": title,
+                }
+                self._stack = report.frames
+            else:
+                self._stack = None
+                self._pending = title
+            return
+
+        m = _SIGNAL_ACCESS.search(title)
+        if m is not None and report.access is None:
+            report.access = {
+                "type": m.group(1).upper(),
+                "size": None,
+                "address": None,
+                "thread": None,
+                "line": title,
+            }
+
+        if _FREE.search(title) is not None and len(report.free) == 0:
+            self._stack = report.free
+        elif _ALLOCATION.search(title) is not None and len(report.allocation) == 0:
+            self._stack = report.allocation
+        elif len(report.frames) == 0 and len(report.related) == 0:
+            # details of the header, e.g. the hint of ASan on SEGV
+            report.description.append(title)
+        else:
+            self._stack = None
+            self._pending = title
+
+    def _add_frame(self, frame):
+        report = self._report
+        if self._stack is None:
+            if self._pending is not None:
+                self._stack = []
+                report.related.append((self._pending, self._stack))
+                self._pending = None
+            elif len(report.frames) == 0:
+                # stack right after the header, e.g. SEGV of ASan or UBSan
+                self._stack = report.frames
+            else:
+                return
+        self._stack.append(frame)
+
+
+def parse_sanitizer_output(output):
+    """
+    Parse the whole output of a program, return the list of reports.
+    """
+    parser = SanitizerParser()
+    reports = parser.feed(output)
+    reports += parser.close()
+    return reports
@@ -1,33 +1,84 @@
+import bisect
+import re
+
+from tools.exec_cache import exec_cache_instance
 from tools.file_integration import (
-    file_get_content,
     file_get_decorated_content,
-    file_get_line_count,
+    file_get_entry,
+    file_invalidate,
 )
 from tools.gdb_integration import gdb_instance
-from tools.lsp_integration import lsp_instance, uri_to_path
+from tools.lsp_cache import lsp_cache_instance, lsp_cache_invalidate
+from tools.lsp_integration import (
+    lsp_diagnostics,
+    lsp_did_change,
+    lsp_did_reload,
+    lsp_instance,
+    uri_to_path,
+)
+from tools.patch_engine import patch_engine_instance
 
 ######################################################################
 # LSP functions
 
 
-def _get_fuzzy_position(filename, lineno, symbol):
-    FUZZY_RANGE = 10
-    line_count = file_get_line_count(filename)
+FUZZY_RANGE = 10
+
 
-    lines_to_search = [lineno]
-    for i in range(1, FUZZY_RANGE + 1):
-        if lineno - i > 0:
-            lines_to_search.append(lineno - i)
-        if lineno + i <= line_count:
-            lines_to_search.append(lineno + i)
-    for i in lines_to_search:
-        line = file_get_content(filename, i, i)
-        pos = line.find(symbol)
-        if pos != -1:
-            # replace tabs with spaces
-            char = pos + len(symbol) + 1
-            return i, char
-    return None, None
+def _get_symbol_identifier(symbol):
+    """
+    Get the identifier to look up in a symbol expression, which is the last
+    identifier outside brackets, e.g. `len` in `s->len`, `arr` in `arr[i]`.
+    """
+    symbol = re.sub(r"\[[^\]]*\]|\([^)]*\)", "", symbol)
+    identifiers = re.findall(r"[A-Za-z_][A-Za-z0-9_]*", symbol)
+    if len(identifiers) == 0:
+        return None
+    return identifiers[-1]
+
+
+def _get_symbol_position(filename, lineno, symbol):
+    """
+    Find the occurrence of the symbol on the nearest line to lineno within
+    FUZZY_RANGE lines, matching whole identifiers only.
+    Return (line, character, None) on success, or (None, None, message) if the
+    symbol is not found or the nearest occurrences are ambiguous.
+    """
+    identifier = _get_symbol_identifier(symbol)
+    if identifier is None:
+        return None, None, f"Symbol {symbol} is not a valid identifier."
+    positions = file_get_entry(filename).get_identifiers().get(identifier, [])
+
+    index = bisect.bisect_left(positions, (lineno, 0))
+    below = positions[index] if index < len(positions) else None
+    above = None
+    if index > 0:
+        # first occurrence on the nearest line above
+        line = positions[index - 1][0]
+        above = positions[bisect.bisect_left(positions, (line, 0))]
+
+    if below is not None and below[0] - lineno > FUZZY_RANGE:
+        below = None
+    if above is not None and lineno - above[0] > FUZZY_RANGE:
+        above = None
+    if below is None and above is None:
+        return (
+            None,
+            None,
+            f"Symbol {symbol} not found in {filename} around line {lineno}.",
+        )
+    if below is not None and above is not None:
+        if below[0] - lineno == lineno - above[0]:
+            return (
+                None,
+                None,
+                f"Symbol {symbol} is ambiguous in {filename} around line {lineno}, "
+                f"found at line {above[0]} and line {below[0]}, please specify the exact line.",
+            )
+        if below[0] - lineno > lineno - above[0]:
+            below = None
+    line, column = below if below is not None else above
+    return line, column, None
 
 
 def lsp_get_symbol_definition(filename, lineno, symbol):
@@ -35,10 +86,16 @@ def lsp_get_symbol_definition(filename, lineno, symbol):
     Get the definition of a symbol at a given position.
     Will perform a fuzzy search around the line.
     """
+    cache = lsp_cache_instance()
+    key = cache.key("definition", filename, lineno, symbol)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
     lsp = lsp_instance()
-    line, char = _get_fuzzy_position(filename, lineno, symbol)
+    line, char, message = _get_symbol_position(filename, lineno, symbol)
     if line is None:
-        return f"Symbol {symbol} not found in {filename} around line {lineno}."
+        return message
     response = lsp.definition(filename, line, char)
     if response is None:
         return (
@@ -47,7 +104,9 @@ def lsp_get_symbol_definition(filename, lineno, symbol):
     file = uri_to_path(response["uri"])
     start_line = response["range"]["start"]["line"] + 1
     end_line = response["range"]["end"]["line"] + 1
-    return file_get_decorated_content(file, start_line, end_line)
+    definition = file_get_decorated_content(file, start_line, end_line)
+    cache.put(key, definition, [filename, file])
+    return definition
 
 
 def lsp_get_symbol_summary(filename, lineno, symbol):
@@ -55,20 +114,34 @@ def lsp_get_symbol_summary(filename, lineno, symbol):
     Get the hover information of a symbol at a given position.
     Will perform a fuzzy search around the line.
     """
+    cache = lsp_cache_instance()
+    key = cache.key("summary", filename, lineno, symbol)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
     lsp = lsp_instance()
-    line, char = _get_fuzzy_position(filename, lineno, symbol)
+    line, char, message = _get_symbol_position(filename, lineno, symbol)
     if line is None:
-        return f"Symbol {symbol} not found in {filename} around line {lineno}."
+        return message
     response = lsp.summary(filename, line, char)
     if response is None:
         return f"Summary of {symbol} not available in {filename} around line {lineno}."
-    return response["contents"]["value"]
+    summary = response["contents"]["value"]
+    cache.put(key, summary, [filename])
+    return summary
 
 
 def lsp_get_function(filename, function):
     """
     Get the function definition.
     """
+    cache = lsp_cache_instance()
+    key = cache.key("function", filename, function)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
     lsp = lsp_instance()
     symbols = lsp.document_symbol(filename)
     body = ""
@@ -80,18 +153,53 @@ def lsp_get_function(filename, function):
             if end_line - start_line + 1 > size:
                 size = end_line - start_line
                 body = file_get_decorated_content(filename, start_line, end_line)
+    if body != "":
+        cache.put(key, body, [filename])
     return body
 
 
+def lsp_get_errors(filename):
+    """
+    Get errors of the current content of the file reported by the language
+    server, as a list of (line, message), or None if not available.
+    """
+    diagnostics = lsp_diagnostics(filename)
+    if diagnostics is None:
+        return None
+    errors = []
+    for diagnostic in diagnostics:
+        # severity 1 is error, others are warnings and hints
+        if diagnostic.get("severity", 1) == 1:
+            line = diagnostic["range"]["start"]["line"] + 1
+            errors.append((line, diagnostic["message"]))
+    return errors
+
+
 ######################################################################
 # GDB functions
 
 
 def gdb_run():
+    """
+    Run the program from start, return the stopped record. If the crash
+    is cached as a core dump, it is loaded instead of running again, and if
+    an identical run exited, its outcome is taken from the execution cache.
+    """
     gdb = gdb_instance()
-    if gdb.is_running():
-        gdb.kill()
-    return gdb.run()
+    stopped = gdb.load_core("crash")
+    if stopped is not None:
+        return stopped
+    cache = exec_cache_instance()
+    key = gdb.get_exec_key("gdb")
+    stopped = cache.get(key)
+    if stopped is not None:
+        return gdb.replay(stopped)
+    stopped = gdb.run()
+    gdb.capture_core(stopped)
+    # crashes are inspected in GDB, so they are only kept as core dumps
+    if stopped["reason"] in ["exited-normally", "exited"]:
+        cache.put(key, stopped)
+    return stopped
 
 
 def gdb_run_sanitizer():
@@ -112,15 +220,17 @@ def gdb_run_to_line(file, line, to_line=None):
     to every line from line to to_line.
     """
     gdb = gdb_instance()
-    if gdb.is_running():
-        gdb.kill()
+    stopped = gdb.load_core(f"{file}:{line}:{to_line}")
+    if stopped is not None:
+        return stopped
 
-    gdb.set_breakpoint(file, line)
+    lines = [line]
     if to_line is not None:
-        for i in range(line + 1, to_line + 1):
-            gdb.set_breakpoint(file, i)
+        lines += gdb.executable_lines(file, line + 1, to_line)
+    numbers = gdb.set_breakpoints(file, lines)
     response = gdb.run()
-    gdb.clear_breakpoints()
+    gdb.capture_core(response)
+    gdb.delete_breakpoints(numbers)
 
     return response
 
@@ -129,30 +239,69 @@ def gdb_print(expression):
     return gdb_instance().print(expression)
 
 
+def gdb_evaluate(expressions, frame=None, variables=False):
+    return gdb_instance().evaluate(expressions, frame, variables)
+
+
 ######################################################################
 # Editor functions
 
-FILE_BACKUPS = {}
+
+def _on_file_modified(filename: str) -> None:
+    """
+    Drop everything cached for the file after it is modified.
+    """
+    lsp_cache_invalidate(filename)
 
 
 def editor_backup_file(filename: str) -> None:
     """
-    Backup the given file.
+    Backup the given file, edits from now on are recorded to restore it.
     """
-    global FILE_BACKUPS
-    with open(filename, "r") as f:
-        FILE_BACKUPS[filename] = f.read()
+    patch_engine_instance().mark(filename)
 
 
 def editor_restore_file(filename: str) -> None:
     """
     Restore the given file.
     """
-    content = FILE_BACKUPS.get(filename, None)
-    if content is None:
+    engine = patch_engine_instance()
+    if not engine.is_marked(filename):
         raise FileNotFoundError(f"File {filename} not found in backups.")
-    with open(filename, "w") as f:
-        f.write(content)
+    file_invalidate(filename)
+    engine.restore(filename)
+    _on_file_modified(filename)
+    lsp_did_reload(filename)
+
+
+def _to_text(new_content: str) -> str:
+    return "".join(line + "\n" for line in new_content.split("\n"))
+
+
+def editor_apply(hunks) -> None:
+    """
+    Apply hunks of one or more files at once, each hunk is (filename,
+    start_line, end_line, new_content), replacing lines from start_line to
+    end_line (inclusive) with new_content, or inserting it after line
+    start_line - 1 if end_line is start_line - 1. Line numbers refer to the
+    files before any hunk is applied. Either all hunks are written or none.
+    """
+    hunks = [
+        (filename, start_line, end_line, _to_text(new_content))
+        for filename, start_line, end_line, new_content in hunks
+    ]
+    for filename, _, _, _ in hunks:
+        file_invalidate(filename)
+    applied = patch_engine_instance().apply(hunks)
+    for filename, file_hunks in applied.items():
+        _on_file_modified(filename)
+        if any(at_end for _, _, _, at_end in file_hunks):
+            # range reaches the end of file, where line ending may differ
+            lsp_did_reload(filename)
+            continue
+        # from the bottom up, so that each change is in current line numbers
+        for start_line, end_line, text, _ in file_hunks:
+            lsp_did_change(filename, start_line, end_line, text)
 
 
 def editor_replace(
@@ -161,21 +310,18 @@ def editor_replace(
     """
     Replace lines from start_line to end_line (inclusive) with new_content.
     """
-    with open(filename, "r") as f:
-        lines = f.readlines()
-    new_lines = [line + "\n" for line in new_content.split("\n")]
-    lines = lines[: start_line - 1] + new_lines + lines[end_line:]
-    with open(filename, "w") as f:
-        f.write("".join(lines))
+    editor_apply([(filename, start_line, end_line, new_content)])
 
 
 def editor_insert_after(filename: str, line: int, new_content: str) -> None:
     """
     Insert new_content after the given line.
     """
-    with open(filename, "r") as f:
-        lines = f.readlines()
-    new_lines = [line + "\n" for line in new_content.split("\n")]
-    lines = lines[:line] + new_lines + lines[line:]
-    with open(filename, "w") as f:
-        f.write("".join(lines))
+    editor_apply([(filename, line + 1, line, new_content)])
+
+
+def editor_diff(root=None) -> str:
+    """
+    Get the unified diff of all backed up files from their backups.
+    """
+    return patch_engine_instance().diff(root)
@@ -1,19 +1,17 @@
-import os
-import shutil
-
-from agent.functions import set_run_mode, test_build, test_run, validate
+from agent.functions import set_run_mode, test_build, test_run
 from shared.arguments import parse_args_validate
+from shared.store import store_artifacts
 from shared.utils import get_logger
+from tools.exec_cache import exec_cache_init
 from tools.gdb_integration import gdb_exit, gdb_init
+from tools.lsp_cache import lsp_cache_init
 from tools.lsp_integration import lsp_exit, lsp_init
 
 logger = get_logger(__name__, log_file="validate.log")
 
 
-def keep_log(profile):
-    if not os.path.exists(f"log/{profile['profile']}"):
-        os.makedirs(f"log/{profile['profile']}")
-    shutil.copyfile("validate.log", f"log/{profile['profile']}/validate.log")
+def keep_log(profile, result):
+    store_artifacts(profile, {"validate.log": "validate.log"}, {"result": result})
 
 
 def validate_patch(profile):
@@ -27,7 +25,31 @@ def validate_patch(profile):
             logger.error(result)
     else:
         result = f"Patch is syntactically invalid: {result}"
-        logger.error(f"{result}: {message}")
+        logger.error(result)
+    return result
+
+
+def run_validation(profile, keep=False):
+    """
+    Validate the confirmed patch and record the result in validate.lock,
+    GDB and LSP should be initialized. Return "valid" or "invalid".
+    """
+    set_run_mode(profile["mode"])
+
+    message = validate_patch(profile)
+    result = ""
+    if message is None:
+        logger.info("Patch is valid")
+        result = "valid"
+    else:
+        logger.error(f"Patch is invalid: {message}")
+        result = "invalid"
+    with open("validate.lock", "w") as f:
+        f.write(result)
+
+    if keep:
+        keep_log(profile, result)
+
     return result
 
 
@@ -40,28 +62,21 @@ if __name__ == "__main__":
         profile["args"],
         profile["env"],
         profile["work"],
+        profile["timeout"],
+        profile["core-cache"],
+        profile["checkpoint"],
+        profile["gdb-index"],
+        profile["gdb-pool"],
     )
 
     logger.info("Initializing LSP")
-    lsp_init(cwd=profile["sandbox"])
+    lsp_init(cwd=profile["sandbox"], index_timeout=profile["index-timeout"])
+    lsp_cache_init(profile["lsp-cache"])
+    exec_cache_init(profile["exec-cache"], profile["sandbox"])
 
-    set_run_mode(profile["mode"])
-
-    message = validate_patch(profile)
-    result = ""
-    if message is None:
-        logger.info("Patch is valid")
-        result = "valid"
-    else:
-        logger.error(f"Patch is invalid: {message}")
-        result = "invalid"
-    with open("validate.lock", "w") as f:
-        f.write(result)
+    run_validation(profile, args.keep)
 
     logger.info("Exiting GDB")
     gdb_exit()
     logger.info("Exiting LSP")
     lsp_exit()
-
-    if args.keep:
-        keep_log(profile)